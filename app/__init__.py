@@ -1,18 +1,40 @@
 from flask import Flask
-from .extensions import db, login_manager
+from .extensions import login_manager
+from . import database, fragments, jobs, json_provider, metrics, migrations, previews, secret_key
+from .api import api as api_blueprint
+from .archive import archive_cli
+from .counters import counters_cli
+from .search import search_cli
+from .stats import stats_cli
+from .transfer import tickets_cli
 from .config import Config
 from .routes import main as main_blueprint
 
 def create_app():
-    app = Flask(__name__)
+    app = Flask(__name__, template_folder='../templates', static_folder='../static')
     app.config.from_object(Config)
+    secret_key.init_app(app)
+    # В обоих режимах разгрузки send_file отдает только заголовки без тела
+    app.config['USE_X_SENDFILE'] = app.config['ATTACHMENT_DELIVERY'] in ('x-accel', 'x-sendfile')
 
-    db.init_app(app)
+    json_provider.init_app(app)
+    database.init_app(app)
     login_manager.init_app(app)
+    metrics.init_app(app)
+    fragments.init_app(app)
+    previews.init_app(app)
 
     app.register_blueprint(main_blueprint)
+    app.register_blueprint(api_blueprint)
+    jobs.init_app(app)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(stats_cli)
+    app.cli.add_command(tickets_cli)
+    app.cli.add_command(migrations.db_cli)
+    app.cli.add_command(archive_cli)
+    app.cli.add_command(counters_cli)
 
-    with app.app_context():
-        db.create_all()  # Создание всех таблиц
+    # Вместо create_all на каждом старте — сверка версии схемы (см. migrations.py)
+    migrations.init_app(app)
 
     return app
@@ -0,0 +1,229 @@
+import getpass
+import os
+from datetime import datetime
+
+from flask import Blueprint, abort, current_app, request, url_for
+from flask_login import current_user
+from werkzeug.exceptions import HTTPException
+
+from .chat import add_message, latest_messages, messages_after
+from .extensions import db
+from .intake import accepted, add_ticket, claim, release
+from .jobs import enqueue
+from .models import ArchivedFile, ArchivedMessage, ArchivedTicket, File, Message, Ticket, TICKET_STATUSES
+from .pagination import keyset_paginate
+from .storage import get_storage, guess_mimetype
+from .tickets import change_status
+
+# JSON API для интеграций и дашбордов: /api/v1/...
+# ?fields=id,title,status — в SELECT попадают только эти колонки; списки
+# листаются курсором; ответы GET несут ETag и отдают 304 по If-None-Match
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+TICKET_FIELDS = ('id', 'created_at', 'received_at', 'closed_at', 'title', 'description',
+                 'status', 'pc_name', 'ip_address', 'is_new', 'version', 'parent_id')
+MESSAGE_FIELDS = ('id', 'ticket_id', 'ip_address', 'pc_name', 'content', 'created_at')
+FILE_FIELDS = ('id', 'ticket_id', 'filename', 'digest', 'size', 'mimetype')
+
+
+@api.errorhandler(HTTPException)
+def handle_error(error):
+    return {'error': error.description}, error.code
+
+
+@api.before_request
+def require_admin():
+    # Сессия администратора, как у /stats.json и /check_new_tickets, но без редиректа на форму входа
+    if not current_user.is_authenticated:
+        abort(401, 'Требуется вход')
+    if current_user.role.name != 'admin':
+        abort(403, 'Доступ запрещен')
+
+
+@api.after_request
+def revalidate(response):
+    # Клиенты перепроверяют ответ каждый раз; неизменившийся — 304 без тела
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    if request.method == 'GET' and response.status_code == 200:
+        response.add_etag()
+        response.make_conditional(request)
+    return response
+
+
+def requested_fields(allowed, required=()):
+    # Возвращает (поля для ответа, поля для SELECT); required нужны курсору
+    raw = request.args.get('fields')
+    if not raw:
+        fields = list(allowed)
+    else:
+        fields = [name.strip() for name in raw.split(',') if name.strip()]
+        unknown = [name for name in fields if name not in allowed]
+        if unknown:
+            abort(400, f'Неизвестные поля: {", ".join(unknown)}')
+    selected = fields + [name for name in required if name not in fields]
+    return fields, selected
+
+
+def columns(model, names):
+    return [getattr(model, name) for name in names]
+
+
+def to_dict(row, fields):
+    data = {}
+    for name in fields:
+        value = getattr(row, name)
+        data[name] = value.isoformat() if isinstance(value, datetime) else value
+    return data
+
+
+def page_size():
+    limit = request.args.get('limit', current_app.config['API_PAGE_SIZE'], type=int)
+    return min(max(limit, 1), current_app.config['API_MAX_PAGE_SIZE'])
+
+
+def find_ticket(ticket_id, names):
+    # Заявка из рабочих таблиц или из архива: (строка, модель заявки)
+    for model in (Ticket, ArchivedTicket):
+        row = db.session.query(*columns(model, names)).filter(model.id == ticket_id).first()
+        if row is not None:
+            return row, model
+    abort(404, 'Заявка не найдена')
+
+
+def hot_ticket(ticket_id):
+    # Заявка, в которую можно писать: архивная — 409, несуществующая — 404
+    ticket = db.session.get(Ticket, ticket_id)
+    if ticket is None:
+        find_ticket(ticket_id, ['id'])
+        abort(409, 'Заявка в архиве')
+    return ticket
+
+
+def ticket_models(ticket_id):
+    # Модели сообщений и файлов той таблицы, где лежит заявка
+    _, model = find_ticket(ticket_id, ['id'])
+    if model is ArchivedTicket:
+        return ArchivedMessage, ArchivedFile
+    return Message, File
+
+
+@api.route('/tickets')
+def list_tickets():
+    fields, selected = requested_fields(TICKET_FIELDS, required=('id', 'created_at'))
+    query = db.session.query(*columns(Ticket, selected))
+    status = request.args.get('status')
+    if status is not None:
+        query = query.filter(Ticket.status == status)
+    if request.args.get('is_new') is not None:
+        query = query.filter(Ticket.is_new.is_(request.args.get('is_new') in ('1', 'true')))
+
+    page = keyset_paginate(query, request.args.get('cursor'), per_page=page_size())
+    return {
+        'items': [to_dict(row, fields) for row in page.items],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+    }
+
+
+@api.route('/tickets', methods=['POST'])
+def create_ticket():
+    data = request.get_json(silent=True) or {}
+    title = (data.get('title') or '').strip()
+    description = (data.get('description') or '').strip()
+    if not title or not description:
+        abort(400, 'Нужны title и description')
+    if len(title) > Ticket.title.type.length:
+        abort(400, 'Слишком длинный title')
+
+    # Повтор запроса с тем же заголовком Idempotency-Key или та же заявка того же
+    # автора в течение INTAKE_DEDUP_TTL возвращает уже созданную заявку с кодом 200
+    pc_name = data.get('pc_name') or getpass.getuser()
+    idempotency_key = request.headers.get('Idempotency-Key')
+    duplicate_id, reservation = claim(title, description, request.remote_addr, pc_name, idempotency_key)
+    if duplicate_id is not None:
+        row, _ = find_ticket(duplicate_id, TICKET_FIELDS)
+        return to_dict(row, TICKET_FIELDS), 200, {'Location': url_for('api.get_ticket', ticket_id=duplicate_id)}
+
+    try:
+        ticket = add_ticket(title, description, request.remote_addr, pc_name)
+        db.session.commit()
+    except Exception:
+        release(reservation)
+        raise
+    accepted(ticket, reservation)
+    return to_dict(ticket, TICKET_FIELDS), 201, {'Location': url_for('api.get_ticket', ticket_id=ticket.id)}
+
+
+@api.route('/tickets/<int:ticket_id>')
+def get_ticket(ticket_id):
+    fields, selected = requested_fields(TICKET_FIELDS)
+    row, _ = find_ticket(ticket_id, selected)
+    return to_dict(row, fields)
+
+
+@api.route('/tickets/<int:ticket_id>', methods=['PATCH'])
+def update_ticket(ticket_id):
+    data = request.get_json(silent=True) or {}
+    status = data.get('status')
+    if status not in TICKET_STATUSES:
+        abort(400, 'Неверный статус')
+    hot_ticket(ticket_id)
+
+    change_status([ticket_id], status)
+    row, _ = find_ticket(ticket_id, TICKET_FIELDS)
+    return to_dict(row, TICKET_FIELDS)
+
+
+@api.route('/tickets/<int:ticket_id>/messages')
+def list_messages(ticket_id):
+    # Как в чате: последние сообщения, ?before_id= — более ранние, ?after_id= — новые
+    message_model, _ = ticket_models(ticket_id)
+    fields, selected = requested_fields(MESSAGE_FIELDS, required=('id',))
+    limit = page_size()
+    after_id = request.args.get('after_id', type=int)
+    if after_id is not None:
+        rows = messages_after(ticket_id, after_id, limit, model=message_model,
+                              columns=columns(message_model, selected))
+        return {'items': [to_dict(row, fields) for row in rows]}
+
+    rows, has_older = latest_messages(ticket_id, limit, request.args.get('before_id', type=int),
+                                      model=message_model, columns=columns(message_model, selected))
+    return {'items': [to_dict(row, fields) for row in rows], 'has_older': has_older}
+
+
+@api.route('/tickets/<int:ticket_id>/messages', methods=['POST'])
+def create_message(ticket_id):
+    ticket = hot_ticket(ticket_id)
+    data = request.get_json(silent=True) or {}
+    content = (data.get('content') or '').strip()
+    if not content:
+        abort(400, 'Пустое сообщение')
+    message = add_message(ticket, content, request.remote_addr, data.get('pc_name') or getpass.getuser())
+    return to_dict(message, MESSAGE_FIELDS), 201
+
+
+@api.route('/tickets/<int:ticket_id>/files')
+def list_files(ticket_id):
+    _, file_model = ticket_models(ticket_id)
+    fields, selected = requested_fields(FILE_FIELDS)
+    rows = (db.session.query(*columns(file_model, selected))
+            .filter(file_model.ticket_id == ticket_id)
+            .order_by(file_model.id).all())
+    return {'items': [to_dict(row, fields) for row in rows]}
+
+
+@api.route('/tickets/<int:ticket_id>/files', methods=['POST'])
+def create_files(ticket_id):
+    # Загрузка multipart-полем file (можно несколько). Перенос в хранилище
+    # делает фоновая задача, поэтому ответ 202 без записей File
+    hot_ticket(ticket_id)
+    uploads = [file for file in request.files.getlist('file') if file]
+    if not uploads:
+        abort(400, 'Нет файлов в поле file')
+
+    storage = get_storage()
+    staged = [dict(storage.stage(file.stream), filename=os.path.basename(file.filename),
+                   mimetype=guess_mimetype(file)) for file in uploads]
+    enqueue('create_ticket', ticket_id=ticket_id, files=staged)
+    return {'accepted': [item['filename'] for item in staged]}, 202
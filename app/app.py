@@ -220,7 +220,6 @@ def index():
     return render_template('index.html')
 
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()  # Создание всех таблиц
+    # Схему создает и обновляет `flask db upgrade` (см. migrations.py)
     app.run(debug=True)
 
@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from .counters import count_moved
+from .extensions import db
+from .models import ArchivedFile, ArchivedMessage, ArchivedTicket, File, Message, Ticket
+from .tickets import with_children
+
+# Горячие таблицы ticket/message/file и архивные *_archive с теми же колонками.
+# Перенос — INSERT ... SELECT и DELETE пачками, каждая пачка в своей транзакции.
+# Поисковый индекс обновляют триггеры: архивные заявки из поиска уходят.
+# Инцидент и присоединенные к нему заявки переносятся вместе: parent_id
+# горячей заявки — внешний ключ и должен указывать на горячую же заявку
+HOT = (Ticket, Message, File)
+ARCHIVE = (ArchivedTicket, ArchivedMessage, ArchivedFile)
+
+
+def _columns(model):
+    return [column.name for column in model.__table__.columns]
+
+
+def _move(ticket_ids, source, target):
+    source_ticket, source_message, source_file = source
+    target_ticket, target_message, target_file = target
+    # Счетчики по авторам учитывают только рабочие таблицы
+    count_moved(source_ticket, ticket_ids, -1 if source is HOT else 1)
+
+    # Сначала заявки, затем зависимые строки; удаление — в обратном порядке
+    pairs = ((source_ticket, target_ticket, source_ticket.id),
+             (source_message, target_message, source_message.ticket_id),
+             (source_file, target_file, source_file.ticket_id))
+    for source_model, target_model, key in pairs:
+        columns = _columns(target_model)
+        select = db.select(*[source_model.__table__.c[name] for name in columns]).where(key.in_(ticket_ids))
+        db.session.execute(db.insert(target_model).from_select(columns, select))
+    for source_model, _, key in reversed(pairs):
+        db.session.execute(db.delete(source_model).where(key.in_(ticket_ids)))
+    db.session.commit()
+
+
+def _protected_ids():
+    # SQLite без AUTOINCREMENT выдает новой строке max(id) + 1. Если унести в архив
+    # строку с максимальным id, он достанется новой заявке (сообщению, файлу)
+    # и столкнется с архивом — поэтому владельцы последних строк остаются в горячих таблицах
+    protected = {db.session.query(db.func.max(Ticket.id)).scalar()}
+    for model in (Message, File):
+        protected.add(db.session.query(model.ticket_id).order_by(model.id.desc()).limit(1).scalar())
+    protected.discard(None)
+    return protected
+
+
+def archive_closed(days, batch_size=500):
+    # Переносит в архив заявки, закрытые больше days дней назад; возвращает их число.
+    # Инцидент, у которого есть присоединенная заявка, не подходящая для архива,
+    # остается на месте; остальные инциденты уходят вместе со своими заявками
+    cutoff = datetime.now() - timedelta(days=days)
+    protected = _protected_ids()
+    old_closed = db.and_(Ticket.status == 'Закрыта', Ticket.closed_at.isnot(None), Ticket.closed_at < cutoff,
+                         Ticket.id.notin_(protected))
+    held = db.select(Ticket.parent_id).where(Ticket.parent_id.isnot(None), db.not_(old_closed))
+    total = 0
+    while True:
+        ids = [row.id for row in (db.session.query(Ticket.id)
+                                  .filter(old_closed, Ticket.id.notin_(held))
+                                  .order_by(Ticket.id)
+                                  .limit(batch_size))]
+        if not ids:
+            return total
+        ids = with_children(ids)
+        _move(ids, HOT, ARCHIVE)
+        total += len(ids)
+
+
+def restore(ticket_id):
+    # Возвращает заявку из архива в рабочие таблицы (например, чтобы переоткрыть).
+    # Присоединенная заявка возвращается вместе со своим инцидентом, если он в архиве,
+    # а инцидент — вместе с присоединенными к нему заявками из архива
+    ticket = db.session.get(ArchivedTicket, ticket_id)
+    if ticket is None:
+        return False
+    root = ticket_id
+    if ticket.parent_id is not None and db.session.get(ArchivedTicket, ticket.parent_id) is not None:
+        root = ticket.parent_id
+    ids = [root] + [row.id for row in db.session.query(ArchivedTicket.id).filter(ArchivedTicket.parent_id == root)]
+    _move(ids, ARCHIVE, HOT)
+    return True
+
+
+archive_cli = AppGroup('archive', help='Архив закрытых заявок.')
+
+
+@archive_cli.command('run')
+@click.option('--days', type=int, default=None, help='Сколько дней назад заявка должна быть закрыта.')
+@click.option('--batch-size', type=int, default=None, help='Заявок в одной транзакции.')
+def run_command(days, batch_size):
+    """Перенести в архив давно закрытые заявки."""
+    days = current_app.config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+    total = archive_closed(days, batch_size)
+    click.echo(f'Перенесено в архив: {total}')
+
+
+@archive_cli.command('restore')
+@click.argument('ticket_id', type=int)
+def restore_command(ticket_id):
+    """Вернуть заявку из архива."""
+    if restore(ticket_id):
+        click.echo(f'Заявка {ticket_id} возвращена из архива')
+    else:
+        click.echo(f'Заявки {ticket_id} в архиве нет')
@@ -0,0 +1,29 @@
+from functools import wraps
+
+from flask import make_response, request
+
+
+def cache_policy(**directives):
+    # Явная политика Cache-Control для маршрута, например cache_policy(no_store=True)
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            response = make_response(view(*args, **kwargs))
+            for key, value in directives.items():
+                setattr(response.cache_control, key, value)
+            return response
+        return wrapped
+    return decorator
+
+
+def apply_default_cache_policy(response):
+    if 'Cache-Control' in response.headers:
+        return response
+
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    if (request.method == 'GET' and response.status_code == 200
+            and response.mimetype == 'text/html' and not response.direct_passthrough):
+        response.add_etag()
+        response.make_conditional(request)
+    return response
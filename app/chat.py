@@ -0,0 +1,63 @@
+from .extensions import db
+from .models import Message
+from .tickets import bump_version
+
+# Все выборки идут по индексу (ticket_id, created_at, id): последние N сообщений,
+# страница "раньше сообщения X" и дельта "после сообщения X" — это диапазоны индекса
+
+
+def _anchor(ticket_id, message_id, model=Message):
+    # (created_at, id) опорного сообщения — точка отсчета для сравнения кортежей
+    return (db.session.query(model.created_at, model.id)
+            .filter(model.id == message_id, model.ticket_id == ticket_id)
+            .first())
+
+
+def _query(model, columns):
+    # columns — выбрать только эти колонки (строки вместо объектов модели)
+    return db.session.query(*columns) if columns else model.query
+
+
+def latest_messages(ticket_id, limit, before_id=None, model=Message, columns=None):
+    # Возвращает (сообщения по возрастанию, есть_ли_более_ранние).
+    # model=ArchivedMessage — то же для заявки из архива
+    key = db.tuple_(model.created_at, model.id)
+    query = _query(model, columns).filter(model.ticket_id == ticket_id)
+    if before_id is not None:
+        anchor = _anchor(ticket_id, before_id, model)
+        if anchor is None:
+            return [], False  # Чужое или удаленное сообщение: не отдаем вместо страницы последние
+        query = query.filter(key < db.tuple_(anchor.created_at, anchor.id))
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+    has_older = len(rows) > limit
+    return list(reversed(rows[:limit])), has_older
+
+
+def messages_after(ticket_id, after_id, limit, model=Message, columns=None):
+    # after_id 0 или None — с начала переписки
+    key = db.tuple_(model.created_at, model.id)
+    query = _query(model, columns).filter(model.ticket_id == ticket_id)
+    if after_id:
+        anchor = _anchor(ticket_id, after_id, model)
+        if anchor is None:
+            return []  # Чужое или удаленное сообщение: не отдаем вместо дельты всю переписку
+        query = query.filter(key > db.tuple_(anchor.created_at, anchor.id))
+    return query.order_by(model.created_at.asc(), model.id.asc()).limit(limit).all()
+
+
+def add_message(ticket, content, ip_address, pc_name):
+    message = Message(ticket_id=ticket.id, ip_address=ip_address, pc_name=pc_name, content=content)
+    db.session.add(message)
+    bump_version([ticket.id])
+    db.session.commit()
+    return message
+
+
+def message_to_dict(message):
+    return {
+        'id': message.id,
+        'pc_name': message.pc_name,
+        'ip_address': message.ip_address,
+        'content': message.content,
+        'created_at': message.created_at.isoformat(sep=' '),
+    }
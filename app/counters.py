@@ -0,0 +1,112 @@
+from collections import defaultdict
+
+import click
+from flask.cli import AppGroup
+
+from .extensions import db
+from .models import RequesterCount, StatusCount, Ticket
+from .stats import upsert_add
+
+# Счетчики рабочих (не архивных) заявок по статусу и по автору и статусу.
+# Обновляются приращениями в тех же транзакциях, что и сами заявки: создание,
+# смена статуса, перенос в архив и обратно, импорт. Очереди админки и
+# "Мои заявки" читают готовые числа вместо COUNT(*) по таблице заявок.
+# Очереди считают только инциденты (заявки без parent_id), как и показывают
+
+
+def _requester(ip_address, pc_name):
+    # Колонки первичного ключа не бывают NULL
+    return ip_address or '', pc_name or ''
+
+
+class Counts:
+    # Накопитель приращений; flush() записывает их одним upsert
+    def __init__(self):
+        self.statuses = defaultdict(int)
+        self.requesters = defaultdict(int)
+
+    def add(self, ip_address, pc_name, status, delta=1, incident=True):
+        status = status or 'Открыта'
+        if incident:
+            self.statuses[status] += delta
+        self.requesters[_requester(ip_address, pc_name) + (status,)] += delta
+
+    def moved(self, ip_address, pc_name, old_status, new_status, incident=True):
+        if old_status != new_status:
+            self.add(ip_address, pc_name, old_status, -1, incident)
+            self.add(ip_address, pc_name, new_status, 1, incident)
+
+    def flush(self):
+        upsert_add(StatusCount, ('status',),
+                   [dict(status=status, count=count) for status, count in self.statuses.items() if count])
+        rows = [dict(ip_address=ip_address, pc_name=pc_name, status=status, count=count)
+                for (ip_address, pc_name, status), count in self.requesters.items() if count]
+        upsert_add(RequesterCount, ('ip_address', 'pc_name', 'status'), rows)
+        self.statuses.clear()
+        self.requesters.clear()
+
+
+def count_created(ticket):
+    counts = Counts()
+    counts.add(ticket.ip_address, ticket.pc_name, ticket.status, incident=ticket.parent_id is None)
+    counts.flush()
+
+
+def count_status_change(rows, new_status):
+    # rows — состояние заявок до UPDATE, с колонками ip_address, pc_name, status, parent_id
+    counts = Counts()
+    for row in rows:
+        counts.moved(row.ip_address, row.pc_name, row.status, new_status, incident=row.parent_id is None)
+    counts.flush()
+
+
+def count_moved(model, ticket_ids, delta):
+    # Перенос заявок между рабочими и архивными таблицами: -1 — ушли в архив, +1 — вернулись
+    counts = Counts()
+    incident = model.parent_id.is_(None)
+    for row in (db.session.query(model.ip_address, model.pc_name, model.status, incident, db.func.count())
+                .filter(model.id.in_(ticket_ids))
+                .group_by(model.ip_address, model.pc_name, model.status, incident)):
+        counts.add(row[0], row[1], row[2], delta * row[4], incident=row[3])
+    counts.flush()
+
+
+def status_counts():
+    # {статус: число заявок} для очередей админки — несколько строк, а не COUNT(*)
+    return {row.status: row.count for row in StatusCount.query}
+
+
+def requester_counts(ip_address, pc_name):
+    # {статус: число заявок} одного автора
+    ip_address, pc_name = _requester(ip_address, pc_name)
+    return {row.status: row.count
+            for row in RequesterCount.query.filter_by(ip_address=ip_address, pc_name=pc_name)}
+
+
+def rebuild(conn):
+    # Полный пересчет по таблице заявок для `flask counters rebuild` и массовой загрузки (bench/seed.py).
+    # Миграции его не вызывают: он следует текущей схеме, а миграции — схеме своей версии
+    ticket = Ticket.__table__.c
+    ip_address = db.func.coalesce(ticket.ip_address, '')
+    pc_name = db.func.coalesce(ticket.pc_name, '')
+    status = db.func.coalesce(ticket.status, 'Открыта')
+
+    conn.execute(db.delete(StatusCount.__table__))
+    conn.execute(db.insert(StatusCount.__table__).from_select(
+        ['status', 'count'],
+        db.select(status, db.func.count()).where(ticket.parent_id.is_(None)).group_by(status)))
+    conn.execute(db.delete(RequesterCount.__table__))
+    conn.execute(db.insert(RequesterCount.__table__).from_select(
+        ['ip_address', 'pc_name', 'status', 'count'],
+        db.select(ip_address, pc_name, status, db.func.count()).group_by(ip_address, pc_name, status)))
+
+
+counters_cli = AppGroup('counters', help='Счетчики заявок.')
+
+
+@counters_cli.command('rebuild')
+def rebuild_command():
+    """Пересчитать счетчики заявок по статусам и авторам."""
+    with db.engine.begin() as conn:
+        rebuild(conn)
+    click.echo('Счетчики пересчитаны')
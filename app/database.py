@@ -0,0 +1,68 @@
+import os
+
+from sqlalchemy import event
+
+from .extensions import db
+
+
+def database_uri():
+    # DATABASE_URL из окружения, по умолчанию локальный SQLite
+    uri = os.environ.get('DATABASE_URL', 'sqlite:///tickets.db')
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]  # Старый формат Heroku и др.
+    return uri
+
+
+def engine_options(config):
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    if uri in ('sqlite://', 'sqlite:///:memory:'):
+        return {}  # БД в памяти живет в одном соединении, пул ей не нужен
+    if uri.startswith('sqlite'):
+        # Для SQLite ожиданием блокировок управляет busy_timeout, пул лишь переиспользует соединения
+        return {
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'connect_args': {'check_same_thread': False},
+        }
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,  # Отбрасываем соединения, закрытые сервером
+    }
+
+
+def sqlite_pragmas(config):
+    return [
+        'PRAGMA journal_mode=WAL',  # Читатели не блокируют писателя и наоборот
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'])}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA cache_size=-{int(config['SQLITE_CACHE_SIZE_KB'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+        'PRAGMA temp_store=MEMORY',
+    ]
+
+
+def init_app(app):
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    db.init_app(app)
+
+    with app.app_context():
+        engine = db.engine
+
+    # Соединения пула не переживают fork (gunicorn --preload и т.п.): дочерний
+    # процесс начинает с пустым пулом и не трогает соединения родителя
+    os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
+    if engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = sqlite_pragmas(app.config)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
@@ -0,0 +1,108 @@
+import threading
+from collections import OrderedDict
+
+from flask import current_app, render_template
+from markupsafe import Markup
+
+from .chat import latest_messages
+from .extensions import db
+from .metrics import FRAGMENT_CACHE
+from .models import ArchivedMessage, File, Message, Ticket
+
+# Кэш отрендеренных кусков страниц в памяти процесса. Ключ включает версию
+# заявки (Ticket.version), которую увеличивает каждое ее изменение, поэтому
+# устаревшие куски не удаляются явно — на них просто перестают ссылаться,
+# и они вытесняются по LRU
+
+
+class FragmentCache:
+    def __init__(self, max_entries=2048, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = value
+            self._bytes += size
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+
+def get_cache():
+    return current_app.extensions['fragment_cache']
+
+
+def _lookup(key):
+    html = get_cache().get(key)
+    FRAGMENT_CACHE.inc((key[0], 'hit' if html is not None else 'miss'))
+    return html
+
+
+def _store(key, template, **context):
+    html = Markup(render_template(template, **context))
+    get_cache().set(key, html)
+    return html
+
+
+def ticket_rows(tickets):
+    # Строки таблицы админки. Файлы и число присоединенных заявок читаются
+    # одним запросом каждое и только для заявок, чьих строк нет в кэше.
+    # Присоединение заявки увеличивает версию инцидента, так что число не устаревает
+    rows, missing = {}, []
+    for ticket in tickets:
+        html = _lookup(('admin_row', ticket.id, ticket.version))
+        if html is None:
+            missing.append(ticket)
+        else:
+            rows[ticket.id] = html
+
+    if missing:
+        ids = [ticket.id for ticket in missing]
+        files = {}
+        for file in File.query.filter(File.ticket_id.in_(ids)).order_by(File.id):
+            files.setdefault(file.ticket_id, []).append(file)
+        similar = dict(db.session.query(Ticket.parent_id, db.func.count())
+                       .filter(Ticket.parent_id.in_(ids)).group_by(Ticket.parent_id).all())
+        for ticket in missing:
+            rows[ticket.id] = _store(('admin_row', ticket.id, ticket.version), '_ticket_row.html',
+                                     ticket=ticket, files=files.get(ticket.id, []),
+                                     similar=similar.get(ticket.id, 0))
+    return [rows[ticket.id] for ticket in tickets]
+
+
+def chat_block(ticket, before_id, archived=False):
+    # Блок чата заявки: без изменений заявки сообщения не перечитываются из БД
+    key = ('chat', archived, ticket.id, ticket.version, before_id)
+    html = _lookup(key)
+    if html is None:
+        messages, has_older = latest_messages(ticket.id, current_app.config['CHAT_PAGE_SIZE'], before_id,
+                                              model=ArchivedMessage if archived else Message)
+        html = _store(key, '_chat.html', ticket=ticket, messages=messages, has_older=has_older)
+    return html
+
+
+def init_app(app):
+    app.extensions['fragment_cache'] = FragmentCache(app.config['FRAGMENT_CACHE_ENTRIES'],
+                                                     app.config['FRAGMENT_CACHE_MAX_BYTES'])
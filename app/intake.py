@@ -0,0 +1,191 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from .counters import count_created
+from .extensions import db
+from .models import Ticket
+from .notifications import notifier
+from .stats import record_created
+from .tickets import bump_version
+
+# Прием новых заявок, общий для формы и API.
+#
+# Повторы: та же заявка от того же автора в течение INTAKE_DEDUP_TTL секунд
+# (двойной клик, повторная отправка формы, повтор запроса API с тем же
+# Idempotency-Key) не создается — возвращается id уже созданной. Сначала
+# проверяется кэш последних отправок в памяти процесса, затем свежие заявки
+# автора в БД по индексу ix_ticket_requester_created_at (повтор мог прийти
+# в другой воркер). Проверка сразу резервирует отправку в кэше: такая же
+# параллельная отправка (двойной клик) ждет, пока первая не создаст заявку
+# или не упадет, а не создает вторую.
+#
+# Инциденты (INTAKE_GROUPING): похожая по заголовку заявка, пришедшая в
+# течение INTAKE_GROUP_WINDOW секунд после открытой заявки-инцидента,
+# становится ее дочерней (parent_id). Дочерние заявки не попадают в очереди
+# админки и уведомления и меняют статус вместе с инцидентом
+#
+# Порядок для вызывающих: claim -> add_ticket -> commit (сразу или в фоновой
+# задаче) -> accepted; при ошибке после claim — release
+
+WORD = re.compile(r'\w+')
+
+
+class RecentSubmissions:
+    # Ключ отправки -> (момент истечения, id заявки, резерв). Пока заявка
+    # создается, id — None, а резерв — метка владельца. TTL у всех записей
+    # одинаковый, поэтому истекшие всегда в начале OrderedDict
+    def __init__(self):
+        self._items = OrderedDict()
+        self._changed = threading.Condition()
+
+    def _sweep(self, now):
+        while self._items:
+            oldest = next(iter(self._items.values()))
+            if oldest[0] > now:
+                break
+            self._items.popitem(last=False)
+
+    def _put(self, keys, item):
+        for key in keys:
+            self._items.pop(key, None)
+            self._items[key] = item
+
+    def claim(self, keys, ttl, wait):
+        # (id заявки, None), если такая отправка уже создана, иначе (None, метка):
+        # ключи зарезервированы за вызывающим. Чужой резерв ждем не дольше wait
+        # секунд, потом перехватываем — создание заявки столько не длится
+        deadline = time.monotonic() + wait
+        with self._changed:
+            while True:
+                now = time.monotonic()
+                self._sweep(now)
+                items = [self._items[key] for key in keys if key in self._items]
+                for item in items:
+                    if item[1] is not None:
+                        return item[1], None
+                if not items or now >= deadline:
+                    token = object()
+                    self._put(keys, (now + ttl, None, token))
+                    return None, token
+                self._changed.wait(deadline - now)
+
+    def remember(self, keys, ticket_id, ttl):
+        with self._changed:
+            self._sweep(time.monotonic())
+            self._put(keys, (time.monotonic() + ttl, ticket_id, None))
+            self._changed.notify_all()
+
+    def release(self, keys, token):
+        with self._changed:
+            for key in keys:
+                item = self._items.get(key)
+                if item is not None and item[2] is token:
+                    del self._items[key]
+            self._changed.notify_all()
+
+
+recent = RecentSubmissions()
+
+
+def fingerprint(title, description, ip_address, pc_name):
+    raw = '\x1f'.join((title.strip(), description.strip(), ip_address or '', pc_name or ''))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _keys(title, description, ip_address, pc_name, idempotency_key):
+    keys = [('fingerprint', fingerprint(title, description, ip_address, pc_name))]
+    if idempotency_key:
+        keys.insert(0, ('key', ip_address, idempotency_key))
+    return keys
+
+
+def claim(title, description, ip_address, pc_name, idempotency_key=None):
+    # (id ранее созданной такой же заявки, None) или (None, резерв). Резерв
+    # передается в accepted() после commit или в release() при ошибке
+    config = current_app.config
+    ttl = config['INTAKE_DEDUP_TTL']
+    if not ttl:
+        return None, None
+    keys = _keys(title, description, ip_address, pc_name, idempotency_key)
+    ticket_id, token = recent.claim(keys, ttl, config['INTAKE_DEDUP_WAIT'])
+    if ticket_id is not None:
+        return ticket_id, None
+
+    since = datetime.now() - timedelta(seconds=ttl)
+    ticket_id = (db.session.query(Ticket.id)
+                 .filter(Ticket.ip_address == ip_address, Ticket.pc_name == pc_name,
+                         Ticket.created_at >= since,
+                         Ticket.title == title, Ticket.description == description)
+                 .order_by(Ticket.id)
+                 .limit(1).scalar())
+    if ticket_id is not None:
+        recent.remember(keys, ticket_id, ttl)  # Создана другим воркером
+        return ticket_id, None
+    return None, (keys, token)
+
+
+def release(reservation):
+    # Отправка не удалась — такие же отправки снова могут создать заявку
+    if reservation is not None:
+        recent.release(*reservation)
+
+
+def _words(text):
+    return {word for word in WORD.findall(text.lower()) if len(word) > 2}
+
+
+def similarity(first, second):
+    # Доля общих слов заголовков (коэффициент Жаккара)
+    first, second = _words(first), _words(second)
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def find_incident(title):
+    # id открытой заявки-инцидента, к которой стоит присоединить новую, или None
+    config = current_app.config
+    if not config['INTAKE_GROUPING']:
+        return None
+    since = datetime.now() - timedelta(seconds=config['INTAKE_GROUP_WINDOW'])
+    candidates = (db.session.query(Ticket.id, Ticket.title)
+                  .filter(Ticket.created_at >= since, Ticket.parent_id.is_(None), Ticket.status != 'Закрыта')
+                  .order_by(Ticket.created_at.desc())
+                  .limit(config['INTAKE_GROUP_CANDIDATES']))
+    best, best_score = None, 0.0
+    for candidate in candidates:
+        score = similarity(title, candidate.title)
+        if score >= config['INTAKE_GROUP_SIMILARITY'] and score > best_score:
+            best, best_score = candidate.id, score  # При равенстве — самый свежий инцидент
+    return best
+
+
+def add_ticket(title, description, ip_address, pc_name):
+    # Новая заявка в текущей сессии (с id, но без commit) вместе со
+    # статистикой, счетчиками и версией инцидента
+    parent_id = find_incident(title)
+    ticket = Ticket(created_at=datetime.now(), title=title, description=description, status='Открыта',
+                    pc_name=pc_name, ip_address=ip_address, parent_id=parent_id,
+                    is_new=parent_id is None)  # О присоединенной к инциденту не уведомляем
+    db.session.add(ticket)
+    db.session.flush()  # Получаем id заявки до commit
+    record_created(ticket)
+    count_created(ticket)
+    if parent_id is not None:
+        bump_version([parent_id])  # В строке инцидента в админке меняется число похожих
+    return ticket
+
+
+def accepted(ticket, reservation):
+    # Вызывается после commit заявки из add_ticket; ждущие повторы получают ее id
+    if reservation is not None:
+        keys, _ = reservation
+        recent.remember(keys, ticket.id, current_app.config['INTAKE_DEDUP_TTL'])
+    if ticket.parent_id is None:
+        notifier.notify(ticket.id)  # Будим ожидающие /new_tickets
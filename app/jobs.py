@@ -0,0 +1,252 @@
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from .extensions import db
+from .models import File, Job
+from .previews import make_preview, preview_kind
+from .storage import get_storage
+from .tickets import bump_version
+
+logger = logging.getLogger(__name__)
+
+# Обработчики задач по имени; их вызывают и локальные воркеры, и задачи Celery
+handlers = {}
+
+# Будит локальных воркеров этого процесса сразу после постановки задачи
+_wakeup = threading.Event()
+
+
+def job(name):
+    def decorator(func):
+        handlers[name] = func
+        return func
+    return decorator
+
+
+@job('create_ticket')
+def store_ticket_files(ticket_id, files):
+    # Переносит загрузки из временных файлов в хранилище и записывает File.
+    # Запись File фиксируется до переноса файла: если попытка упадет на
+    # следующем файле, повтор найдет уже записанные и не потеряет их
+    storage = get_storage()
+    for item in files:
+        stored = File.query.filter_by(ticket_id=ticket_id, filename=item['filename'])
+        if not os.path.exists(item['path']):
+            if stored.first() is None:
+                raise FileNotFoundError(f'Временный файл вложения пропал: {item["path"]}')
+            continue  # Записан и перенесен предыдущей попыткой
+
+        digest, size = item['digest'], item['size']  # Посчитаны при приеме, в stage()
+        if stored.filter_by(digest=digest).first() is None:
+            db.session.add(File(filename=item['filename'], ticket_id=ticket_id, digest=digest,
+                                size=size, mimetype=item['mimetype']))
+            bump_version([ticket_id])
+            db.session.commit()
+        storage.import_file(item['path'], item['mimetype'], digest, size)
+
+    # Превью строятся отдельной задачей, чтобы их сбой не откатывал сохранение файлов
+    previews = [{'digest': file.digest, 'mimetype': file.mimetype}
+                for file in File.query.filter_by(ticket_id=ticket_id)
+                if preview_kind(file.mimetype) is not None]
+    if previews:
+        enqueue('make_previews', files=previews)
+
+
+@job('make_previews')
+def make_previews(files):
+    storage = get_storage()
+    for item in files:
+        make_preview(storage, item['digest'], item['mimetype'], current_app.config)
+
+
+def run_job(name, payload):
+    handlers[name](**payload)
+
+
+def enqueue(name, **payload):
+    # Ставит задачу в очередь и фиксирует текущую транзакцию вместе с ней
+    backend = current_app.config['JOBS_BACKEND']
+    if backend == 'celery':
+        db.session.commit()
+        from .tasks import TASKS
+        TASKS[name].delay(**payload)
+    elif backend == 'sync':
+        db.session.commit()
+        run_job(name, payload)
+    else:
+        db.session.add(Job(name=name, payload=json.dumps(payload),
+                           max_attempts=current_app.config['JOBS_MAX_ATTEMPTS']))
+        db.session.commit()
+        _wakeup.set()
+
+
+def requeue_stale():
+    # Задачи, чей воркер умер посреди выполнения, возвращаются в очередь
+    deadline = datetime.now() - timedelta(seconds=current_app.config['JOBS_VISIBILITY_TIMEOUT'])
+    count = (Job.query
+             .filter(Job.status == 'running', Job.locked_at < deadline)
+             .update({Job.status: 'queued', Job.locked_at: None}, synchronize_session=False))
+    db.session.commit()
+    return count
+
+
+def claim_job():
+    # Забираем самую старую готовую задачу; условный UPDATE не дает
+    # двум воркерам (в том числе из разных процессов) взять одну и ту же
+    while True:
+        now = datetime.now()
+        job_id = (db.session.query(Job.id)
+                  .filter(Job.status == 'queued', Job.run_after <= now)
+                  .order_by(Job.id)
+                  .limit(1).scalar())
+        if job_id is None:
+            db.session.commit()
+            return None
+        claimed = (Job.query
+                   .filter(Job.id == job_id, Job.status == 'queued')
+                   .update({Job.status: 'running', Job.locked_at: now, Job.attempts: Job.attempts + 1},
+                           synchronize_session=False))
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+
+
+def process_one():
+    job = claim_job()
+    if job is None:
+        return False
+
+    try:
+        run_job(job.name, json.loads(job.payload))
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc()
+        logger.exception('Задача %s #%s завершилась ошибкой', job.name, job.id)
+        job = db.session.get(Job, job.id)
+        job.last_error = error
+        job.locked_at = None
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+        else:
+            delay = current_app.config['JOBS_RETRY_DELAY'] * 2 ** (job.attempts - 1)
+            job.status = 'queued'
+            job.run_after = datetime.now() + timedelta(seconds=delay)
+        db.session.commit()
+    else:
+        Job.query.filter_by(id=job.id).delete(synchronize_session=False)
+        db.session.commit()
+    return True
+
+
+def queue_stats():
+    rows = db.session.query(Job.status, db.func.count(Job.id)).group_by(Job.status).all()
+    stats = {'queued': 0, 'running': 0, 'failed': 0}
+    stats.update(dict(rows))
+    return stats
+
+
+class WorkerPool:
+    # Пул потоков, разбирающих таблицу job. Каждый процесс приложения
+    # может держать свой пул — задачи между ними не дублируются
+    def __init__(self, app, size):
+        self.app = app
+        self.size = size
+        self.threads = []
+        self._stop = threading.Event()
+
+    def start(self):
+        for number in range(self.size):
+            thread = threading.Thread(target=self._run, name=f'job-worker-{number}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        _wakeup.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def _run(self):
+        poll_interval = self.app.config['JOBS_POLL_INTERVAL']
+        last_requeue = 0
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    if time.monotonic() - last_requeue > poll_interval * 30:
+                        requeue_stale()
+                        last_requeue = time.monotonic()
+                    while not self._stop.is_set() and process_one():
+                        pass
+            except Exception:
+                logger.exception('Ошибка в воркере очереди')
+            _wakeup.wait(poll_interval)
+            _wakeup.clear()
+
+
+_start_lock = threading.Lock()
+
+
+def start_workers(app, size):
+    with _start_lock:
+        pool = app.extensions.get('job_workers')
+        if pool is None:
+            pool = WorkerPool(app, size)
+            pool.start()
+            app.extensions['job_workers'] = pool
+        return pool
+
+
+def init_app(app):
+    app.cli.add_command(jobs_cli)
+    backend = app.config['JOBS_BACKEND']
+    if backend == 'celery':
+        from .tasks import celery_init_app
+        celery_init_app(app)
+    elif backend == 'local' and app.config['JOBS_WORKERS'] > 0:
+        # Пул поднимается с первым запросом, а не при импорте: CLI-команды обходятся без потоков
+        @app.before_request
+        def ensure_job_workers():
+            if 'job_workers' not in app.extensions:
+                start_workers(app, app.config['JOBS_WORKERS'])
+
+
+jobs_cli = AppGroup('jobs', help='Очередь фоновых задач.')
+
+
+@jobs_cli.command('worker')
+@click.option('--threads', default=2, show_default=True, help='Количество потоков-воркеров.')
+def worker_command(threads):
+    """Запустить отдельный процесс-воркер для локальной очереди."""
+    pool = start_workers(current_app._get_current_object(), threads)
+    click.echo(f'Воркеры запущены: {len(pool.threads)}')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pool.stop(timeout=5)
+
+
+@jobs_cli.command('stats')
+def stats_command():
+    """Показать глубину очереди по статусам."""
+    for status, count in queue_stats().items():
+        click.echo(f'{status}: {count}')
+
+
+@jobs_cli.command('retry-failed')
+def retry_failed_command():
+    """Вернуть упавшие задачи в очередь."""
+    count = (Job.query.filter_by(status='failed')
+             .update({Job.status: 'queued', Job.attempts: 0, Job.run_after: datetime.now()},
+                     synchronize_session=False))
+    db.session.commit()
+    click.echo(f'Возвращено в очередь: {count}')
@@ -0,0 +1,47 @@
+import logging
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson — необязательная зависимость
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Сериализация JSON для всех ответов приложения (dict из view, jsonify, API).
+# Выбирается настройкой JSON_ENCODER: 'orjson' — быстрый кодировщик на Rust,
+# 'json' — стандартный модуль. Без установленного orjson используется 'json'
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    def _dumps(self, obj):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        return self._dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Тело собирается сразу в bytes, без промежуточной строки
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps(obj), mimetype=self.mimetype)
+
+
+PROVIDERS = {
+    'orjson': OrjsonProvider,
+    'json': DefaultJSONProvider,
+}
+
+
+def init_app(app):
+    name = app.config['JSON_ENCODER']
+    if name == 'orjson' and orjson is None:
+        logger.info('orjson не установлен, используется стандартный json')
+        name = 'json'
+    app.json = PROVIDERS[name](app)
@@ -0,0 +1,155 @@
+import bisect
+import logging
+import threading
+import time
+
+from flask import g, has_request_context, request, request_finished, request_started
+from sqlalchemy import event
+
+from .extensions import db
+
+logger = logging.getLogger(__name__)
+
+# Метрики собираются в памяти процесса и отдаются в текстовом формате Prometheus.
+# При нескольких воркерах каждый процесс отдает свои значения — их суммирует Prometheus
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = list(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((labels, list(counts)) for labels, counts in self._values.items())
+        for labels, counts in items:
+            base = _labels(self.labelnames, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ['+Inf'], counts[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{base}}} {counts[-1]}')
+            lines.append(f'{self.name}_count{{{base}}} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f'{self.name}{{{_labels(self.labelnames, labels)}}} {value}')
+        return lines
+
+
+def _labels(names, values):
+    return ','.join(f'{name}="{str(value).replace(chr(34), "")}"' for name, value in zip(names, values))
+
+
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Время обработки запроса.',
+                             ('endpoint', 'method'),
+                             (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+REQUEST_QUERIES = Histogram('http_request_sql_queries', 'SQL-запросов на один HTTP-запрос.',
+                            ('endpoint',), (0, 1, 2, 3, 5, 10, 20, 50, 100, 200))
+REQUEST_SQL_TIME = Histogram('http_request_sql_seconds', 'Суммарное время SQL на один HTTP-запрос.',
+                             ('endpoint',), (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+REQUESTS = Counter('http_requests_total', 'Обработанные запросы.', ('endpoint', 'method', 'status'))
+SLOW_QUERIES = Counter('db_slow_queries_total', 'SQL-запросы дольше METRICS_SLOW_QUERY_MS.', ('endpoint',))
+FRAGMENT_CACHE = Counter('fragment_cache_lookups_total', 'Обращения к кэшу фрагментов страниц.', ('fragment', 'result'))
+
+ALL_METRICS = (REQUEST_DURATION, REQUEST_QUERIES, REQUEST_SQL_TIME, REQUESTS, SLOW_QUERIES, FRAGMENT_CACHE)
+
+
+def render_metrics():
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+def init_app(app):
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    slow_query_seconds = app.config['METRICS_SLOW_QUERY_MS'] / 1000
+    response_headers = app.config['METRICS_RESPONSE_HEADERS']
+
+    def on_request_started(sender, **extra):
+        g.metrics_started = time.perf_counter()
+        g.sql_count = 0
+        g.sql_time = 0.0
+
+    def on_request_finished(sender, response, **extra):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        endpoint = _endpoint()
+        REQUEST_DURATION.observe((endpoint, request.method), duration)
+        REQUEST_QUERIES.observe((endpoint,), g.sql_count)
+        REQUEST_SQL_TIME.observe((endpoint,), g.sql_time)
+        REQUESTS.inc((endpoint, request.method, response.status_code))
+        if response_headers:
+            response.headers['X-Query-Count'] = str(g.sql_count)
+            response.headers['Server-Timing'] = (f'db;dur={g.sql_time * 1000:.2f};desc="{g.sql_count} queries", '
+                                                 f'app;dur={duration * 1000:.2f}')
+
+    request_started.connect(on_request_started, app, weak=False)
+    request_finished.connect(on_request_finished, app, weak=False)
+
+    # Запросы одного соединения идут строго по очереди, поэтому хватает одной
+    # метки времени: after_cursor_execute не вызывается, если запрос упал, и
+    # метку просто перезапишет следующий запрос этого соединения
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info['query_started'] = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info.pop('query_started')
+        # Запросы фоновых воркеров идут вне HTTP-запроса и к нему не относятся
+        if not has_request_context() or 'sql_count' not in g:
+            return
+        g.sql_count += 1
+        g.sql_time += elapsed
+        if elapsed >= slow_query_seconds:
+            SLOW_QUERIES.inc((_endpoint(),))
+            logger.warning('Медленный запрос %.1f мс в %s: %s', elapsed * 1000, _endpoint(), statement)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+    @app.route('/metrics')
+    def metrics():
+        response = app.response_class(render_metrics(), mimetype='text/plain; version=0.0.4')
+        response.cache_control.no_store = True
+        return response
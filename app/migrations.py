@@ -0,0 +1,304 @@
+import logging
+
+import click
+from flask.cli import AppGroup
+
+from .extensions import db
+from .search import ensure_search_index
+
+logger = logging.getLogger(__name__)
+
+# Схема БД версионируется: номер примененной миграции хранится в schema_version.
+# При старте приложение только сверяет этот номер, а сами изменения схемы
+# выполняет `flask db upgrade` — один раз при выкладке, а не в каждом воркере.
+#
+# Миграции не читают текущие модели: каждая описывает свои таблицы, колонки и
+# индексы такими, какими они были в ее версии. Иначе БД старой версии получала
+# бы раньше времени объекты, зависящие от колонок из следующих миграций
+
+# Схема версии 1
+SCHEMA_V1 = db.MetaData()
+
+db.Table(
+    'role', SCHEMA_V1,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('name', db.String(50), unique=True),
+)
+db.Table(
+    'user', SCHEMA_V1,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('username', db.String(150), unique=True, nullable=False),
+    db.Column('password', db.String(150), nullable=False),
+    db.Column('role_id', db.Integer, db.ForeignKey('role.id')),
+)
+db.Table(
+    'ticket', SCHEMA_V1,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('created_at', db.DateTime, nullable=False),
+    db.Column('received_at', db.DateTime),
+    db.Column('closed_at', db.DateTime),
+    db.Column('title', db.String(150), nullable=False),
+    db.Column('description', db.Text, nullable=False),
+    db.Column('status', db.String(50)),
+    db.Column('pc_name', db.String(150)),
+    db.Column('ip_address', db.String(50)),
+    db.Column('is_new', db.Boolean, index=True),
+    db.Index('ix_ticket_created_at_id', 'created_at', 'id'),
+)
+db.Table(
+    'message', SCHEMA_V1,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('ticket_id', db.Integer, db.ForeignKey('ticket.id'), nullable=False),
+    db.Column('ip_address', db.String(45), nullable=False),
+    db.Column('pc_name', db.String(255), nullable=False),
+    db.Column('content', db.Text, nullable=False),
+    db.Column('created_at', db.DateTime),
+    db.Index('ix_message_ticket_created_id', 'ticket_id', 'created_at', 'id'),
+)
+db.Table(
+    'file', SCHEMA_V1,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('filename', db.String(150), nullable=False),
+    db.Column('ticket_id', db.Integer, db.ForeignKey('ticket.id'), nullable=False),
+    db.Column('digest', db.String(64), index=True),
+    db.Column('size', db.Integer),
+    db.Column('mimetype', db.String(100)),
+)
+db.Table(
+    'job', SCHEMA_V1,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('name', db.String(100), nullable=False),
+    db.Column('payload', db.Text, nullable=False),
+    db.Column('status', db.String(20), nullable=False),
+    db.Column('attempts', db.Integer, nullable=False),
+    db.Column('max_attempts', db.Integer, nullable=False),
+    db.Column('run_after', db.DateTime, nullable=False),
+    db.Column('locked_at', db.DateTime),
+    db.Column('last_error', db.Text),
+    db.Column('created_at', db.DateTime, nullable=False),
+    db.Index('ix_job_status_run_after', 'status', 'run_after'),
+)
+db.Table(
+    'stats_daily', SCHEMA_V1,
+    db.Column('day', db.Date, primary_key=True),
+    db.Column('status', db.String(50), primary_key=True),
+    db.Column('created', db.Integer, nullable=False),
+    db.Column('entered', db.Integer, nullable=False),
+    db.Column('left', db.Integer, nullable=False),
+    db.Column('receive_count', db.Integer, nullable=False),
+    db.Column('receive_seconds', db.Float, nullable=False),
+    db.Column('close_count', db.Integer, nullable=False),
+    db.Column('close_seconds', db.Float, nullable=False),
+)
+db.Table(
+    'stats_histogram', SCHEMA_V1,
+    db.Column('day', db.Date, primary_key=True),
+    db.Column('metric', db.String(20), primary_key=True),
+    db.Column('bucket', db.Integer, primary_key=True),
+    db.Column('count', db.Integer, nullable=False),
+)
+
+# Архивные таблицы версии 2
+ARCHIVE_V2 = db.MetaData()
+
+db.Table(
+    'ticket_archive', ARCHIVE_V2,
+    db.Column('id', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('created_at', db.DateTime, nullable=False),
+    db.Column('received_at', db.DateTime),
+    db.Column('closed_at', db.DateTime),
+    db.Column('title', db.String(150), nullable=False),
+    db.Column('description', db.Text, nullable=False),
+    db.Column('status', db.String(50)),
+    db.Column('pc_name', db.String(150)),
+    db.Column('ip_address', db.String(50)),
+    db.Column('is_new', db.Boolean),
+)
+db.Table(
+    'message_archive', ARCHIVE_V2,
+    db.Column('id', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('ticket_id', db.Integer, db.ForeignKey('ticket_archive.id'), nullable=False),
+    db.Column('ip_address', db.String(45), nullable=False),
+    db.Column('pc_name', db.String(255), nullable=False),
+    db.Column('content', db.Text, nullable=False),
+    db.Column('created_at', db.DateTime),
+    db.Index('ix_message_archive_ticket_created_id', 'ticket_id', 'created_at', 'id'),
+)
+db.Table(
+    'file_archive', ARCHIVE_V2,
+    db.Column('id', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('filename', db.String(150), nullable=False),
+    db.Column('ticket_id', db.Integer, db.ForeignKey('ticket_archive.id'), nullable=False, index=True),
+    db.Column('digest', db.String(64)),
+    db.Column('size', db.Integer),
+    db.Column('mimetype', db.String(100)),
+)
+
+# Счетчики версий 4 и 5
+COUNTERS = db.MetaData()
+
+REQUESTER_COUNT_V4 = db.Table(
+    'requester_count', COUNTERS,
+    db.Column('ip_address', db.String(50), primary_key=True),
+    db.Column('pc_name', db.String(150), primary_key=True),
+    db.Column('status', db.String(50), primary_key=True),
+    db.Column('count', db.Integer, nullable=False),
+)
+STATUS_COUNT_V5 = db.Table(
+    'status_count', COUNTERS,
+    db.Column('status', db.String(50), primary_key=True),
+    db.Column('count', db.Integer, nullable=False),
+)
+
+
+def _add_missing_columns(conn, table):
+    # create_all не трогает существующие таблицы, поэтому новые колонки
+    # (например, digest/size/mimetype у file) добавляются через ALTER TABLE
+    existing = {column['name'] for column in db.inspect(conn).get_columns(table.name)}
+    preparer = conn.dialect.identifier_preparer
+    for column in table.columns:
+        if column.name not in existing:
+            definition = column.type.compile(dialect=conn.dialect)
+            conn.execute(db.text(f'ALTER TABLE {preparer.quote(table.name)} '
+                                 f'ADD COLUMN {preparer.quote(column.name)} {definition}'))
+
+
+def _add_column(conn, table, name, definition):
+    if name not in {column['name'] for column in db.inspect(conn).get_columns(table)}:
+        conn.execute(db.text(f'ALTER TABLE {table} ADD COLUMN {name} {definition}'))
+
+
+def baseline(conn):
+    # Приводит к схеме версии 1 как пустую БД, так и БД, созданную
+    # до появления версий через create_all: таблицы, колонки, индексы, поиск
+    SCHEMA_V1.create_all(conn)
+    for table in SCHEMA_V1.sorted_tables:
+        _add_missing_columns(conn, table)
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+    ensure_search_index(conn)
+
+
+def create_archive_tables(conn):
+    ARCHIVE_V2.create_all(conn)
+
+
+def add_ticket_version(conn):
+    for table in ('ticket', 'ticket_archive'):
+        _add_column(conn, table, 'version', 'INTEGER DEFAULT 0 NOT NULL')
+
+
+def add_requester_counts(conn):
+    conn.execute(db.text('CREATE INDEX IF NOT EXISTS ix_ticket_requester_created_at '
+                         'ON ticket (ip_address, pc_name, created_at)'))
+    REQUESTER_COUNT_V4.create(conn, checkfirst=True)
+    conn.execute(db.text('DELETE FROM requester_count'))
+    conn.execute(db.text("""
+        INSERT INTO requester_count (ip_address, pc_name, status, count)
+        SELECT COALESCE(ip_address, ''), COALESCE(pc_name, ''), COALESCE(status, 'Открыта'), COUNT(*)
+        FROM ticket
+        GROUP BY COALESCE(ip_address, ''), COALESCE(pc_name, ''), COALESCE(status, 'Открыта')
+    """))
+
+
+def add_status_counts(conn):
+    # Инцидентов (parent_id) в этой версии еще нет: в очередях все заявки
+    conn.execute(db.text('CREATE INDEX IF NOT EXISTS ix_ticket_status_created_at ON ticket (status, created_at)'))
+    STATUS_COUNT_V5.create(conn, checkfirst=True)
+    conn.execute(db.text('DELETE FROM status_count'))
+    conn.execute(db.text("""
+        INSERT INTO status_count (status, count)
+        SELECT COALESCE(status, 'Открыта'), COUNT(*) FROM ticket GROUP BY COALESCE(status, 'Открыта')
+    """))
+
+
+def add_ticket_parent(conn):
+    _add_column(conn, 'ticket', 'parent_id', 'INTEGER REFERENCES ticket (id)')
+    _add_column(conn, 'ticket_archive', 'parent_id', 'INTEGER')
+    conn.execute(db.text('CREATE INDEX IF NOT EXISTS ix_ticket_parent_id ON ticket (parent_id)'))
+
+
+# (версия, описание, функция). Новые миграции только дописываются в конец,
+# не меняются после выпуска и должны быть идемпотентны
+MIGRATIONS = [
+    (1, 'Базовая схема: таблицы, колонки, индексы, поисковый индекс', baseline),
+    (2, 'Архивные таблицы ticket_archive, message_archive, file_archive', create_archive_tables),
+    (3, 'Счетчик версии заявки для кэша фрагментов', add_ticket_version),
+    (4, 'Индекс заявок по автору и счетчики requester_count', add_requester_counts),
+    (5, 'Индекс заявок по статусу и счетчики очередей status_count', add_status_counts),
+    (6, 'Инциденты: ticket.parent_id', add_ticket_parent),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    if not db.inspect(conn).has_table('schema_version'):
+        return 0
+    return conn.execute(db.text('SELECT MAX(version) FROM schema_version')).scalar() or 0
+
+
+def upgrade(target=LATEST_VERSION):
+    # Каждая миграция выполняется в своей транзакции вместе с отметкой версии,
+    # поэтому прерванное обновление продолжается с того же места
+    applied = []
+    with db.engine.connect() as conn:
+        version = current_version(conn)
+    for number, description, migrate in MIGRATIONS:
+        if number <= version or number > target:
+            continue
+        with db.engine.begin() as conn:
+            migrate(conn)
+            conn.execute(db.text('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)'))
+            conn.execute(db.text('DELETE FROM schema_version'))
+            conn.execute(db.text('INSERT INTO schema_version (version) VALUES (:version)'), {'version': number})
+        logger.info('Применена миграция %s: %s', number, description)
+        applied.append((number, description))
+    return applied
+
+
+def init_app(app):
+    # При старте — один запрос к schema_version. Если схема отстала, запросы
+    # получают 503, пока не будет выполнен `flask db upgrade`
+    with app.app_context(), db.engine.connect() as conn:
+        version = current_version(conn)
+    if version >= LATEST_VERSION:
+        return
+    if app.config['SCHEMA_AUTO_UPGRADE']:
+        with app.app_context():
+            upgrade()
+        return
+
+    logger.error('Схема БД на версии %s, требуется %s: выполните `flask db upgrade`', version, LATEST_VERSION)
+    state = {'ready': False}
+
+    @app.before_request
+    def require_schema():
+        if state['ready']:
+            return None
+        with db.engine.connect() as conn:
+            state['ready'] = current_version(conn) >= LATEST_VERSION
+        if not state['ready']:
+            return 'Схема базы данных устарела: выполните `flask db upgrade`', 503
+        return None
+
+
+db_cli = AppGroup('db', help='Версия схемы БД и миграции.')
+
+
+@db_cli.command('upgrade')
+@click.option('--target', type=int, default=LATEST_VERSION, show_default=True, help='До какой версии обновить.')
+def upgrade_command(target):
+    """Применить недостающие миграции схемы."""
+    applied = upgrade(target)
+    for number, description in applied:
+        click.echo(f'{number}: {description}')
+    if not applied:
+        click.echo('Схема уже актуальна')
+
+
+@db_cli.command('current')
+def current_command():
+    """Показать версию схемы в БД."""
+    with db.engine.connect() as conn:
+        version = current_version(conn)
+    click.echo(f'{version} (последняя: {LATEST_VERSION})')
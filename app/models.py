@@ -5,7 +5,14 @@ from datetime import datetime
 
 #db = SQLAlchemy()
 
+TICKET_STATUSES = ('Открыта', 'В работе', 'Закрыта')
+
 class Message(db.Model):
+    __table_args__ = (
+        # История чата заявки читается диапазонами по этому индексу
+        db.Index('ix_message_ticket_created_id', 'ticket_id', 'created_at', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), nullable=False)
     ip_address = db.Column(db.String(45), nullable=False)
@@ -13,7 +20,7 @@ class Message(db.Model):
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    ticket = db.relationship('Ticket', backref='messages')
+    ticket = db.relationship('Ticket', backref=db.backref('messages', order_by='Message.id'))
 
 
 
@@ -30,6 +37,15 @@ class User(db.Model, UserMixin):
     role = db.relationship('Role', backref='users')
 
 class Ticket(db.Model):
+    __table_args__ = (
+        # Составной индекс под курсорную пагинацию (created_at, id)
+        db.Index('ix_ticket_created_at_id', 'created_at', 'id'),
+        # Заявки одного автора по дате: "Мои заявки" читают диапазон индекса
+        db.Index('ix_ticket_requester_created_at', 'ip_address', 'pc_name', 'created_at'),
+        # Очереди админки по статусу (/admin?status=...)
+        db.Index('ix_ticket_status_created_at', 'status', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     created_at = db.Column(db.DateTime, nullable=False)
     received_at = db.Column(db.DateTime)
@@ -40,7 +56,11 @@ class Ticket(db.Model):
     pc_name = db.Column(db.String(150))
     ip_address = db.Column(db.String(50))
     files = db.relationship('File', backref='ticket', lazy=True)
-    is_new = db.Column(db.Boolean, default=True)  # Новое поле
+    is_new = db.Column(db.Boolean, default=True, index=True)  # Новое поле
+    # Растет при каждом изменении заявки, ее сообщений и файлов; ключ кэша фрагментов
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Заявка-инцидент, к которой присоединена похожая (см. intake.py); у самих инцидентов NULL
+    parent_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), index=True)
     # is_new = db.Column(db.Boolean, default=True)  # Новое поле
 
 
@@ -48,3 +68,113 @@ class File(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(150), nullable=False)
     ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), nullable=False)
+    digest = db.Column(db.String(64), index=True)  # sha256 содержимого, ключ в хранилище
+    size = db.Column(db.Integer)
+    mimetype = db.Column(db.String(100))
+
+
+class Job(db.Model):
+    # Очередь фоновых задач в той же БД (бэкенд JOBS_BACKEND='local')
+    __table_args__ = (
+        db.Index('ix_job_status_run_after', 'status', 'run_after'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # Аргументы задачи в JSON
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+
+class StatsDaily(db.Model):
+    # Суточные итоги по статусам, обновляются инкрементально (см. stats.py)
+    __tablename__ = 'stats_daily'
+
+    day = db.Column(db.Date, primary_key=True)
+    status = db.Column(db.String(50), primary_key=True)
+    created = db.Column(db.Integer, nullable=False, default=0)  # Создано заявок (только для "Открыта")
+    entered = db.Column(db.Integer, nullable=False, default=0)  # Перешло в статус за день
+    left = db.Column(db.Integer, nullable=False, default=0)  # Вышло из статуса за день
+    receive_count = db.Column(db.Integer, nullable=False, default=0)
+    receive_seconds = db.Column(db.Float, nullable=False, default=0)  # Сумма времени до получения
+    close_count = db.Column(db.Integer, nullable=False, default=0)
+    close_seconds = db.Column(db.Float, nullable=False, default=0)  # Сумма времени до закрытия
+
+
+class StatusCount(db.Model):
+    # Число рабочих заявок в каждом статусе — счетчики очередей админки (см. counters.py)
+    __tablename__ = 'status_count'
+
+    status = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RequesterCount(db.Model):
+    # Число рабочих заявок автора по статусам, обновляется инкрементально (см. counters.py)
+    __tablename__ = 'requester_count'
+
+    ip_address = db.Column(db.String(50), primary_key=True)
+    pc_name = db.Column(db.String(150), primary_key=True)
+    status = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class StatsHistogram(db.Model):
+    # Гистограмма длительностей для перцентилей: metric — 'receive' или 'close'
+    __tablename__ = 'stats_histogram'
+
+    day = db.Column(db.Date, primary_key=True)
+    metric = db.Column(db.String(20), primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Архив: закрытые заявки старше ARCHIVE_AFTER_DAYS переносятся сюда вместе с
+# сообщениями и файлами (см. archive.py), чтобы рабочие таблицы и их индексы
+# оставались маленькими. id сохраняются, ссылки на заявки не меняются
+class ArchivedTicket(db.Model):
+    __tablename__ = 'ticket_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    received_at = db.Column(db.DateTime)
+    closed_at = db.Column(db.DateTime)
+    title = db.Column(db.String(150), nullable=False)
+    description = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(50))
+    pc_name = db.Column(db.String(150))
+    ip_address = db.Column(db.String(50))
+    is_new = db.Column(db.Boolean, default=False)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    parent_id = db.Column(db.Integer)
+    files = db.relationship('ArchivedFile', backref='ticket', lazy=True)
+
+
+class ArchivedMessage(db.Model):
+    __tablename__ = 'message_archive'
+    __table_args__ = (
+        db.Index('ix_message_archive_ticket_created_id', 'ticket_id', 'created_at', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    ticket_id = db.Column(db.Integer, db.ForeignKey('ticket_archive.id'), nullable=False)
+    ip_address = db.Column(db.String(45), nullable=False)
+    pc_name = db.Column(db.String(255), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime)
+
+
+class ArchivedFile(db.Model):
+    __tablename__ = 'file_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    filename = db.Column(db.String(150), nullable=False)
+    ticket_id = db.Column(db.Integer, db.ForeignKey('ticket_archive.id'), nullable=False, index=True)
+    digest = db.Column(db.String(64))
+    size = db.Column(db.Integer)
+    mimetype = db.Column(db.String(100))
@@ -0,0 +1,22 @@
+import threading
+
+
+class TicketNotifier:
+    # Внутрипроцессный будильник: ticket() сообщает id новой заявки,
+    # ожидающие long-poll запросы просыпаются сразу, а не по таймеру
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._last_id = 0
+
+    def notify(self, ticket_id):
+        with self._cond:
+            self._last_id = max(self._last_id, ticket_id)
+            self._cond.notify_all()
+
+    def wait(self, since_id, timeout):
+        # Заявки из других процессов сюда не попадают — их подберет повторный запрос по таймауту
+        with self._cond:
+            return self._cond.wait_for(lambda: self._last_id > since_id, timeout)
+
+
+notifier = TicketNotifier()
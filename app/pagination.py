@@ -0,0 +1,105 @@
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import current_app
+
+from .extensions import db
+from .models import Ticket
+
+# Кэш приблизительных итогов: ключ — SQL запроса, значение — (время, количество).
+# Ключей столько же, сколько разных фильтров (автор, статус, поиск), поэтому
+# кэш ограничен PAGINATION_TOTAL_CACHE_SIZE записями и вытесняет давно не нужные
+_total_cache = OrderedDict()
+_total_lock = threading.Lock()
+
+
+def encode_cursor(ticket, direction):
+    # Курсор непрозрачен для клиента: направление + ключ сортировки (created_at, id)
+    payload = [direction, ticket.created_at.isoformat(), ticket.id]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, created_at, ticket_id = json.loads(base64.urlsafe_b64decode(padded))
+        if direction not in ('next', 'prev'):
+            raise ValueError(direction)
+        return direction, datetime.fromisoformat(created_at), int(ticket_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def approximate_total(query):
+    # Точный COUNT(*) выполняется не чаще раза в PAGINATION_TOTAL_TTL секунд
+    ttl = current_app.config.get('PAGINATION_TOTAL_TTL', 60)
+    size = current_app.config.get('PAGINATION_TOTAL_CACHE_SIZE', 1000)
+    key = str(query.statement.compile(compile_kwargs={'literal_binds': True}))
+    now = time.monotonic()
+    with _total_lock:
+        cached = _total_cache.get(key)
+        if cached and now - cached[0] < ttl:
+            _total_cache.move_to_end(key)
+            return cached[1]
+    total = query.order_by(None).count()
+    with _total_lock:
+        _total_cache[key] = (now, total)
+        _total_cache.move_to_end(key)
+        while len(_total_cache) > size:
+            _total_cache.popitem(last=False)
+    return total
+
+
+class KeysetPage:
+    def __init__(self, items, has_next, has_prev, query, with_total, total=None):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_cursor = encode_cursor(items[-1], 'next') if has_next and items else None
+        self.prev_cursor = encode_cursor(items[0], 'prev') if has_prev and items else None
+        self._query = query
+        self._with_total = with_total
+        self._total = total
+
+    @property
+    def total(self):
+        if not self._with_total:
+            return None
+        if self._total is not None:
+            return self._total
+        return approximate_total(self._query)
+
+
+def keyset_paginate(query, cursor=None, per_page=15, with_total=False, total=None):
+    # Постраничный вывод по ключу (created_at, id) от новых к старым,
+    # без OFFSET и без COUNT(*) на каждый запрос. total — уже известный
+    # итог (например, из счетчиков), тогда COUNT(*) не выполняется вовсе
+    key = db.tuple_(Ticket.created_at, Ticket.id)
+    decoded = decode_cursor(cursor) if cursor else None
+
+    if decoded is None:
+        rows = query.order_by(Ticket.created_at.desc(), Ticket.id.desc()).limit(per_page + 1).all()
+        has_next = len(rows) > per_page
+        return KeysetPage(rows[:per_page], has_next, False, query, with_total, total)
+
+    direction, created_at, ticket_id = decoded
+    if direction == 'next':
+        rows = (query.filter(key < db.tuple_(created_at, ticket_id))
+                .order_by(Ticket.created_at.desc(), Ticket.id.desc())
+                .limit(per_page + 1).all())
+        has_next = len(rows) > per_page
+        return KeysetPage(rows[:per_page], has_next, True, query, with_total, total)
+
+    rows = (query.filter(key > db.tuple_(created_at, ticket_id))
+            .order_by(Ticket.created_at.asc(), Ticket.id.asc())
+            .limit(per_page + 1).all())
+    if not rows:
+        return keyset_paginate(query, None, per_page, with_total, total)
+    has_prev = len(rows) > per_page
+    rows = list(reversed(rows[:per_page]))
+    return KeysetPage(rows, True, has_prev, query, with_total, total)
@@ -0,0 +1,138 @@
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+from flask import current_app
+
+from .storage import send_path
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow есть в requirments.txt; без него миниатюр картинок нет, только ссылки
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Превью вложений лежат рядом с блобом под тем же sha256 с суффиксом,
+# поэтому одинаковые файлы разных заявок делят одно превью:
+#   картинки и PDF — миниатюра JPEG (<digest>.thumb.jpg),
+#   текст — начало файла в UTF-8 (<digest>.preview.txt)
+SUFFIXES = {
+    'image': '.thumb.jpg',
+    'pdf': '.thumb.jpg',
+    'text': '.preview.txt',
+}
+MIMETYPES = {
+    '.thumb.jpg': 'image/jpeg',
+    '.preview.txt': 'text/plain',  # charset=utf-8 добавляет Flask
+}
+
+
+def preview_kind(mimetype):
+    mimetype = mimetype or ''
+    if mimetype == 'image/svg+xml':
+        return None  # Векторная картинка: Pillow ее не откроет
+    if mimetype.startswith('image/'):
+        return 'image'
+    if mimetype == 'application/pdf':
+        return 'pdf'
+    if mimetype.startswith('text/'):
+        return 'text'
+    return None
+
+
+def preview_path(storage, digest, mimetype):
+    kind = preview_kind(mimetype)
+    if kind is None:
+        return None
+    return storage.path(digest) + SUFFIXES[kind]
+
+
+def send_preview(storage, path):
+    # Имя файла превью содержит sha256 исходника — им же служит ETag.
+    # Как и вложения, в режимах x-accel/x-sendfile отдается фронтовым сервером
+    mimetype = next(value for suffix, value in MIMETYPES.items() if path.endswith(suffix))
+    response = send_path(path, storage.root, mimetype=mimetype, etag=os.path.basename(path),
+                         max_age=current_app.config['PREVIEW_MAX_AGE'])
+    response.cache_control.public = False
+    response.cache_control.private = True  # Как и сами вложения — не для общих кэшей
+    return response
+
+
+def _image_thumbnail(source, target, size):
+    if Image is None:
+        return False
+    with Image.open(source) as image:
+        image.draft('RGB', (size, size))  # JPEG декодируется сразу в уменьшенном масштабе
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        image.convert('RGB').save(target, 'JPEG', quality=80, optimize=True)
+    return True
+
+
+def _pdf_thumbnail(source, target, size, timeout):
+    # Первая страница через pdftoppm (poppler-utils), если он установлен
+    pdftoppm = shutil.which('pdftoppm')
+    if pdftoppm is None:
+        return False
+    prefix = target[:-len('.jpg')]
+    subprocess.run([pdftoppm, '-f', '1', '-l', '1', '-singlefile', '-jpeg', '-scale-to', str(size),
+                    source, prefix], check=True, timeout=timeout, capture_output=True)
+    return True
+
+
+def _text_snippet(stream, target, chars):
+    with stream as f:
+        raw = f.read(chars * 4)  # До 4 байт на символ UTF-8
+    for encoding in ('utf-8', 'cp1251'):
+        try:
+            text = raw.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        text = raw.decode('utf-8', errors='replace')
+    with open(target, 'w', encoding='utf-8') as f:
+        f.write(text[:chars])
+    return True
+
+
+def make_preview(storage, digest, mimetype, config):
+    # Создает превью, если его еще нет; возвращает путь или None, если для
+    # этого типа превью не делается, нет нужного инструмента или файл не
+    # удалось разобрать (битая картинка, сбой pdftoppm) — это не ошибка задачи
+    path = preview_path(storage, digest, mimetype)
+    if path is None or os.path.exists(path):
+        return path
+    source, encoding = storage.locate(digest)
+    if source is None:
+        return None
+
+    kind = preview_kind(mimetype)
+    if kind != 'text' and encoding is not None:
+        return None  # Миниатюры строятся только из несжатых картинок и PDF
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=SUFFIXES[kind][-4:])
+    os.close(fd)
+    try:
+        if kind == 'image':
+            made = _image_thumbnail(source, tmp, config['PREVIEW_SIZE'])
+        elif kind == 'pdf':
+            made = _pdf_thumbnail(source, tmp, config['PREVIEW_SIZE'], config['PREVIEW_TIMEOUT'])
+        else:
+            made = _text_snippet(storage.open(digest), tmp, config['PREVIEW_TEXT_CHARS'])
+        if not made:
+            return None
+        os.replace(tmp, path)  # Читатели видят либо готовое превью, либо никакого
+    except Exception:
+        logger.warning('Не удалось построить превью %s (%s)', digest, mimetype, exc_info=True)
+        return None
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+
+def init_app(app):
+    app.add_template_global(preview_kind)
@@ -1,23 +1,60 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, send_from_directory
+from flask import Blueprint, Response, abort, current_app, render_template, redirect, stream_with_context, url_for, flash, request
 from flask_login import login_user, login_required, logout_user, current_user
-from datetime import datetime
+from sqlalchemy.orm import joinedload, selectinload
 import getpass
 import os
+import time
 
 from .extensions import db, login_manager
-from .models import User, Ticket, Message, File
-from .forms import TicketForm
+from .models import User, Ticket, File, ArchivedFile, ArchivedTicket, TICKET_STATUSES
+from .caching import apply_default_cache_policy, cache_policy
+from .chat import add_message, latest_messages, message_to_dict, messages_after
+from .counters import requester_counts, status_counts
+from .fragments import chat_block, ticket_rows
+from .intake import accepted, add_ticket, claim, release
+from .jobs import enqueue, queue_stats
+from .notifications import notifier
+from .pagination import keyset_paginate
+from .previews import preview_path, send_preview
+from .search import search_tickets
+from .stats import sla_report
+from .storage import get_storage, guess_mimetype, send_blob, send_legacy
+from .tickets import bump_version, change_status, mark_seen
+from .transfer import CSV_TABLES, export_csv, export_jsonl
 
 main = Blueprint('main', __name__)
 
+
+def paginate_tickets(query, total=None):
+    # Курсорная пагинация по умолчанию; ?page=N или PAGINATION_MODE='offset' — старый режим.
+    # total — итог из счетчиков, если он известен: тогда COUNT(*) не нужен
+    per_page = current_app.config['PAGINATION_PER_PAGE']
+    page = request.args.get('page', type=int)
+    if page is not None or current_app.config['PAGINATION_MODE'] == 'offset':
+        pagination = query.order_by(Ticket.created_at.desc()).paginate(
+            page=page or 1, per_page=per_page, error_out=False, count=total is None)
+        if total is not None:
+            pagination.total = total
+        return pagination
+    return keyset_paginate(query, request.args.get('cursor'), per_page=per_page,
+                           with_total=current_app.config['PAGINATION_WITH_TOTAL'], total=total)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Роль подгружается тем же запросом, чтобы current_user.role не вызывал отдельный SELECT
+    return db.session.get(User, int(user_id), options=[joinedload(User.role)])
+
+@main.app_context_processor
+def inject_statuses():
+    # Список статусов для шаблонов, чтобы не дублировать его в HTML
+    return {'TICKET_STATUSES': TICKET_STATUSES}
 
 @main.after_request
 def add_header(response):
-    response.cache_control.max_age = 31536000  # Устанавливаем время кэширования в секундах (1 год)
-    return response
+    # Кэш-политика по умолчанию для страниц: браузер всегда перепроверяет,
+    # а неизменившийся HTML получает 304 по ETag. Маршруты со своей политикой
+    # (вложения, JSON) выставляют Cache-Control сами
+    return apply_default_cache_policy(response)
 
 @main.route('/login', methods=['GET', 'POST'])
 def login():
@@ -44,85 +81,155 @@ def admin():
     if current_user.role.name != 'admin':
         return "Доступ запрещен", 403
 
-    page = request.args.get('page', 1, type=int)
-    tickets = Ticket.query.order_by(Ticket.created_at.desc()).paginate(page=page, per_page=15, error_out=False)
+    # Очередь одного статуса (/admin?status=...) — диапазон индекса ix_ticket_status_created_at
+    status = request.args.get('status')
+    if status not in TICKET_STATUSES:
+        status = None
+    # Присоединенные к инцидентам заявки в очередях не показываются — только число похожих в строке инцидента
+    query = Ticket.query.filter(Ticket.parent_id.is_(None))
+    if status is not None:
+        query = query.filter(Ticket.status == status)
+    tickets = paginate_tickets(query)
+
+    # Строки неизменившихся заявок берутся из кэша фрагментов, файлы читаются
+    # только для остальных. Шаблон рендерится до commit: после него объекты
+    # истекают и перечитывались бы по одному
+    html = render_template('admin.html', tickets=tickets, rows=ticket_rows(tickets.items),
+                           status=status, counts=status_counts())
+
+    mark_seen(tickets.items)
+
+    return html
+
+
+def requester():
+    # Автор заявки определяется по IP-адресу и имени ПК
+    return request.remote_addr, getpass.getuser()
 
-    for ticket in tickets.items:
-        ticket.is_new = False
-    db.session.commit()
 
-    return render_template('admin.html', tickets=tickets)
+def can_view(ticket):
+    # Заявку видит ее автор (по IP или имени ПК) и администратор
+    user_ip, user_pc_name = requester()
+    if ticket.ip_address == user_ip or ticket.pc_name == user_pc_name:
+        return True
+    return current_user.is_authenticated and current_user.role.name == 'admin'
+
+
+def post_message(ticket, content):
+    return add_message(ticket, content, *requester())
 
 
 @main.route('/ticket/<int:ticket_id>', methods=['GET', 'POST'])
 def view_ticket(ticket_id):
-    ticket = Ticket.query.get_or_404(ticket_id)
+    ticket = Ticket.query.options(selectinload(Ticket.files)).get(ticket_id)
+    archived = ticket is None
+    if archived:
+        # Давно закрытые заявки лежат в архиве и открываются оттуда только для чтения
+        ticket = ArchivedTicket.query.options(selectinload(ArchivedTicket.files)).get_or_404(ticket_id)
 
     # Проверяем, что заявка принадлежит текущему пользователю или администратору
-    user_ip = request.remote_addr
-    user_pc_name = getpass.getuser()
-    if ticket.ip_address != user_ip and ticket.pc_name != user_pc_name and current_user.role.name != 'admin':
+    if not can_view(ticket):
         return "Доступ запрещен", 403
 
-    # Обновляем состояние заявки на "не новая"
-    if current_user.is_authenticated:
-        if current_user.role.name == 'admin' and ticket.is_new:
-            ticket.is_new = False
-            db.session.commit()
-
     if request.method == 'POST':
-        content = request.form['content']
-        new_message = Message(ticket_id=ticket.id, ip_address=user_ip, pc_name=user_pc_name, content=content)
-        db.session.add(new_message)
-        db.session.commit()
+        if archived:
+            flash('Заявка в архиве, писать в нее нельзя')
+            return redirect(url_for('main.view_ticket', ticket_id=ticket.id))
+        post_message(ticket, request.form['content'])
         flash('Сообщение отправлено!')
-        return redirect(url_for('view_ticket', ticket_id=ticket.id))
+        return redirect(url_for('main.view_ticket', ticket_id=ticket.id))
+
+    # Только последние сообщения; более ранние подгружаются по ссылке "Показать ранние".
+    # Пока версия заявки не менялась, блок чата берется из кэша фрагментов
+    before_id = request.args.get('before', type=int)
+    is_admin = current_user.is_authenticated and current_user.role.name == 'admin'
+    similar = []
+    if is_admin and not archived:
+        # Заявки, присоединенные к этой как к инциденту (чужие заявки — только администратору)
+        similar = (db.session.query(Ticket.id, Ticket.title, Ticket.pc_name, Ticket.ip_address)
+                   .filter(Ticket.parent_id == ticket.id).order_by(Ticket.id).all())
+    html = render_template('view_ticket.html', ticket=ticket, chat=chat_block(ticket, before_id, archived),
+                           archived=archived, similar=similar)
+
+    # Обновляем состояние заявки на "не новая" (после рендера, чтобы не перечитывать заявку)
+    if current_user.is_authenticated and not archived:
+        if current_user.role.name == 'admin':
+            mark_seen([ticket])
+
+    return html
+
+
+@main.route('/ticket/<int:ticket_id>/messages', methods=['GET', 'POST'])
+@cache_policy(no_store=True)
+def ticket_messages(ticket_id):
+    ticket = Ticket.query.get_or_404(ticket_id)
+    if not can_view(ticket):
+        return "Доступ запрещен", 403
+
+    if request.method == 'POST':
+        # Отправка без перезагрузки страницы: в ответ только новое сообщение
+        data = request.get_json(silent=True) or request.form
+        content = (data.get('content') or '').strip()
+        if not content:
+            return {'error': 'Пустое сообщение'}, 400
+        return {'message': message_to_dict(post_message(ticket, content))}, 201
 
-    messages = Message.query.filter_by(ticket_id=ticket.id).all()
-    return render_template('view_ticket.html', ticket=ticket, messages=messages)
+    limit = current_app.config['CHAT_PAGE_SIZE']
+    before_id = request.args.get('before_id', type=int)
+    if before_id is not None:
+        messages, has_older = latest_messages(ticket.id, limit, before_id)
+        return {'messages': [message_to_dict(m) for m in messages], 'has_older': has_older}
+
+    # Дельта: только сообщения после after_id, чтобы чат обновлялся на месте
+    messages = messages_after(ticket.id, request.args.get('after_id', 0, type=int), limit)
+    return {'messages': [message_to_dict(m) for m in messages]}
 
 
 
 @main.route('/ticket', methods=['GET', 'POST'])
 def ticket():
+    from .forms import TicketForm  # WTForms нужен только этим страницам — не грузим его при старте воркера
     form = TicketForm()
     if form.validate_on_submit():
-        new_ticket = Ticket(
-            created_at=datetime.now(),
-            title=form.title.data,
-            description=form.description.data,
-            status="Открыта",
-            pc_name=getpass.getuser(),
-            ip_address=request.remote_addr,
-            is_new=True  # Устанавливаем флаг новой заявки
-        )
-        db.session.add(new_ticket)
-        db.session.commit()
-
-        # Создание уникального каталога для файлов заявки
-        ticket_folder = os.path.join(main.config['UPLOAD_FOLDER'], str(new_ticket.id))
-        os.makedirs(ticket_folder, exist_ok=True)  # Создаем каталог, если он не существует
-
-        # Обработка загрузки файлов
-        if form.files.data:
-            files = request.files.getlist(form.files.name)  # Получаем список загруженных файлов
-            for file in files:
-                if file:
-                    filename = file.filename
-                    file_path = os.path.join(ticket_folder, filename)  # Сохраняем файл в уникальном каталоге
-                    file.save(file_path)  # Сохраняем файл на сервере
-
-                    # Сохраняем информацию о файле в базе данных
-                    new_file = File(filename=filename, ticket_id=new_ticket.id)
-                    db.session.add(new_file)
-
-        db.session.commit()
-        flash('Заявка успешно создана!')
-        return redirect(url_for('ticket'))
+        user_ip, user_pc_name = requester()
+        # Повторная отправка той же заявки (двойной клик, F5) ничего не создает
+        duplicate_id, reservation = claim(form.title.data, form.description.data, user_ip, user_pc_name)
+        if duplicate_id is not None:
+            flash(f'Такая заявка уже создана (№{duplicate_id})')
+            return redirect(url_for('main.ticket'))
+
+        try:
+            new_ticket = add_ticket(form.title.data, form.description.data, user_ip, user_pc_name)
+
+            # Загрузки только сбрасываются во временные файлы (с подсчетом хэша);
+            # перенос в хранилище и записи File делает фоновая задача
+            staged = []
+            if form.files.data:
+                storage = get_storage()
+                files = request.files.getlist(form.files.name)  # Получаем список загруженных файлов
+                for file in files:
+                    if file:
+                        staged.append(dict(storage.stage(file.stream), filename=os.path.basename(file.filename),
+                                           mimetype=guess_mimetype(file)))
+
+            if staged:
+                enqueue('create_ticket', ticket_id=new_ticket.id, files=staged)
+            else:
+                db.session.commit()
+        except Exception:
+            release(reservation)
+            raise
+        accepted(new_ticket, reservation)
+        if new_ticket.parent_id is None:
+            flash('Заявка успешно создана!')
+        else:
+            flash(f'Заявка создана и присоединена к заявке №{new_ticket.parent_id} о той же проблеме')
+        return redirect(url_for('main.ticket'))
     return render_template('ticket_form.html', form=form)
 
 @main.route('/check_new_tickets')
 @login_required
+@cache_policy(no_store=True)
 def check_new_tickets():
     if current_user.role.name != 'admin':
         return "Доступ запрещен", 403
@@ -132,58 +239,173 @@ def check_new_tickets():
     return {'new_tickets': tickets_data}
 
 
+def tickets_after(since_id):
+    limit = current_app.config['NEW_TICKETS_LIMIT']
+    return (Ticket.query.with_entities(Ticket.id, Ticket.title)
+            .filter(Ticket.id > since_id, Ticket.parent_id.is_(None))
+            .order_by(Ticket.id)
+            .limit(limit).all())
+
+
+@main.route('/new_tickets')
+@login_required
+@cache_policy(no_store=True)
+def new_tickets():
+    if current_user.role.name != 'admin':
+        return "Доступ запрещен", 403
+
+    since_id = request.args.get('since_id', type=int)
+    if since_id is None:
+        # Первый запрос: непросмотренные заявки и отметка, с которой продолжать
+        rows = (Ticket.query.with_entities(Ticket.id, Ticket.title)
+                .filter(Ticket.is_new.is_(True))
+                .order_by(Ticket.id)
+                .limit(current_app.config['NEW_TICKETS_LIMIT']).all())
+        last_id = db.session.query(db.func.max(Ticket.id)).scalar() or 0
+    else:
+        rows = tickets_after(since_id)
+        timeout = current_app.config['NEW_TICKETS_POLL_TIMEOUT']
+        deadline = time.monotonic() + min(request.args.get('timeout', timeout, type=float), timeout)
+        while not rows and time.monotonic() < deadline:
+            # Будильник срабатывает только на заявки своего процесса; при нескольких
+            # воркерах чужие находит перепроверка БД раз в NEW_TICKETS_RECHECK секунд
+            db.session.close()  # Не держим соединение с БД на время ожидания
+            notifier.wait(since_id, min(current_app.config['NEW_TICKETS_RECHECK'], deadline - time.monotonic()))
+            rows = tickets_after(since_id)
+        last_id = rows[-1].id if rows else since_id
+
+    tickets_data = [{'id': row.id, 'title': row.title} for row in rows]
+    return {'new_tickets': tickets_data, 'last_id': last_id}
+
+
 @main.route('/update_ticket/<int:ticket_id>', methods=['POST'])
 @login_required
 def update_ticket(ticket_id):
     if current_user.role.name != 'admin':
         return "Доступ запрещен", 403
 
-    ticket = Ticket.query.get_or_404(ticket_id)
     new_status = request.form.get('status')
+    if new_status not in TICKET_STATUSES:
+        return "Неверный статус", 400
 
-    # Обновление статуса и соответствующих дат
-    ticket.status = new_status
-    if new_status == 'В работе' and ticket.received_at is None:
-        ticket.received_at = datetime.now()  # Устанавливаем дату получения
-    elif new_status == 'Закрыта' and ticket.closed_at is None:
-        if ticket.received_at is None:
-            ticket.received_at = datetime.now()            
-        ticket.closed_at = datetime.now()  # Устанавливаем дату закрытия
+    # Один UPDATE по первичному ключу — выполняется сразу, чтобы сообщение
+    # и следующая загрузка админки показывали уже новый статус
+    if not change_status([ticket_id], new_status):
+        abort(404)
 
-    db.session.commit()
     flash('Статус заявки обновлен!')
-    return redirect(url_for('admin'))
+    return redirect(request.referrer or url_for('main.admin'))
+
+
+@main.route('/update_tickets', methods=['POST'])
+@login_required
+def update_tickets():
+    if current_user.role.name != 'admin':
+        return "Доступ запрещен", 403
+
+    new_status = request.form.get('status')
+    if new_status not in TICKET_STATUSES:
+        return "Неверный статус", 400
+    ticket_ids = request.form.getlist('ticket_ids', type=int)
+
+    # Все выбранные заявки меняются одним UPDATE и одним commit
+    count = change_status(ticket_ids, new_status) if ticket_ids else 0
+    flash(f'Статус обновлен у заявок: {count}')
+    return redirect(request.referrer or url_for('main.admin'))
+
+@main.route('/search')
+@login_required
+def search():
+    if current_user.role.name != 'admin':
+        return "Доступ запрещен", 403
+
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    results, has_next = search_tickets(query, page, current_app.config['PAGINATION_PER_PAGE'])
+    return render_template('search.html', query=query, results=results, page=page, has_next=has_next)
+
+@main.route('/stats')
+@login_required
+def stats():
+    if current_user.role.name != 'admin':
+        return "Доступ запрещен", 403
+
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
+    return render_template('stats.html', report=sla_report(days), days=days)
+
+@main.route('/stats.json')
+@login_required
+@cache_policy(no_cache=True, private=True)
+def stats_json():
+    if current_user.role.name != 'admin':
+        return "Доступ запрещен", 403
+
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
+    return sla_report(days)
+
+@main.route('/export')
+@login_required
+def export():
+    if current_user.role.name != 'admin':
+        return "Доступ запрещен", 403
+
+    # Ответ отдается потоком по мере чтения БД, без сборки файла в памяти
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    if request.args.get('format', 'jsonl') == 'csv':
+        table = request.args.get('table', 'tickets')
+        if table not in CSV_TABLES:
+            return "Неизвестная таблица", 400
+        chunks, mimetype, filename = export_csv(table, batch_size), 'text/csv', f'{table}.csv'
+    else:
+        chunks, mimetype, filename = export_jsonl(batch_size), 'application/x-ndjson', 'tickets.jsonl'
+
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    response.cache_control.no_store = True
+    return response
+
+@main.route('/jobs')
+@login_required
+@cache_policy(no_store=True)
+def jobs_status():
+    if current_user.role.name != 'admin':
+        return "Доступ запрещен", 403
+
+    return queue_stats()
 
 @main.route('/my_tickets')
 def my_tickets():
     # Получаем IP-адрес и имя ПК текущего пользователя
-    user_ip = request.remote_addr
-    user_pc_name = getpass.getuser()
+    user_ip, user_pc_name = requester()
 
-    # Находим все заявки, соответствующие IP-адресу и имени ПК
-    page = request.args.get('page', 1, type=int)
-    tickets = Ticket.query.order_by(Ticket.created_at.desc()).paginate(page=page, per_page=15, error_out=False)  # Сортируем по дате создания
+    # Заявки, соответствующие IP-адресу и имени ПК: диапазон индекса
+    # ix_ticket_requester_created_at, уже упорядоченный по дате создания
+    # Итог берется из счетчиков requester_count, которые страница и так читает
+    counts = requester_counts(user_ip, user_pc_name)
+    tickets = paginate_tickets(Ticket.query.filter(Ticket.ip_address == user_ip, Ticket.pc_name == user_pc_name),
+                               total=sum(counts.values()))
 
-    return render_template('my_tickets.html', tickets=tickets)
+    return render_template('my_tickets.html', tickets=tickets, counts=counts)
 
 @main.route('/edit_ticket/<int:ticket_id>', methods=['GET', 'POST'])
 def edit_ticket(ticket_id):
     ticket = Ticket.query.get_or_404(ticket_id)
 
     # Проверяем, что заявка принадлежит текущему пользователю
-    user_ip = request.remote_addr
-    user_pc_name = getpass.getuser()
+    user_ip, user_pc_name = requester()
     if ticket.ip_address != user_ip or ticket.pc_name != user_pc_name:
         return "Доступ запрещен", 403
 
+    from .forms import TicketForm
     form = TicketForm()
     if form.validate_on_submit():
         ticket.title = form.title.data
         ticket.description = form.description.data
         # ticket.status = form.status.data
+        bump_version([ticket.id])  # Атомарный version + 1, как и в остальных местах
         db.session.commit()
         flash('Заявка успешно обновлена!')
-        return redirect(url_for('my_tickets'))
+        return redirect(url_for('main.my_tickets'))
 
     # Заполняем форму текущими данными заявки
     form.title.data = ticket.title
@@ -194,11 +416,30 @@ def edit_ticket(ticket_id):
 
 @main.route('/uploads/<int:ticket_id>/<filename>')
 def download_file(ticket_id, filename):
-    # Создаем путь к каталогу, где хранятся файлы для данной заявки
-    ticket_folder = os.path.join(main.config['UPLOAD_FOLDER'], str(ticket_id))
-    
-    # Проверяем, существует ли файл
-    return send_from_directory(ticket_folder, filename, as_attachment=True)
+    storage = get_storage()
+    file = File.query.filter_by(ticket_id=ticket_id, filename=filename).first()
+    if file is None:
+        file = ArchivedFile.query.filter_by(ticket_id=ticket_id, filename=filename).first()
+    if file is not None and file.digest:
+        return send_blob(storage, file.digest, file.filename, file.mimetype, file.size)
+
+    # Старые файлы лежат в каталоге заявки под исходным именем
+    return send_legacy(storage, ticket_id, filename)
+
+@main.route('/uploads/<int:ticket_id>/<filename>/preview')
+def preview_file(ticket_id, filename):
+    # Миниатюра или текстовое превью, построенные фоновой задачей make_previews.
+    # Пока превью нет (или для типа его не бывает) — 404, страница показывает только ссылку
+    file = File.query.filter_by(ticket_id=ticket_id, filename=filename).first()
+    if file is None:
+        file = ArchivedFile.query.filter_by(ticket_id=ticket_id, filename=filename).first()
+    if file is None or not file.digest:
+        abort(404)
+    storage = get_storage()
+    path = preview_path(storage, file.digest, file.mimetype)
+    if path is None or not os.path.exists(path):
+        abort(404)
+    return send_preview(storage, path)
 
 @main.route('/')
 def index():
@@ -0,0 +1,136 @@
+import re
+
+import click
+from flask.cli import AppGroup
+
+from .extensions import db
+from .models import Ticket
+
+# Полнотекстовый индекс SQLite FTS5 по заявкам и сообщениям чата.
+# rowid: заявка — id * 2, сообщение — id * 2 + 1, чтобы триггеры обновляли
+# и удаляли строки индекса по rowid, а не сканированием
+SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        title, body, ticket_id UNINDEXED, kind UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS search_ticket_insert AFTER INSERT ON ticket BEGIN
+        INSERT INTO search_index(rowid, title, body, ticket_id, kind)
+        VALUES (new.id * 2, new.title, new.description, new.id, 't');
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_ticket_update AFTER UPDATE OF title, description ON ticket BEGIN
+        UPDATE search_index SET title = new.title, body = new.description WHERE rowid = new.id * 2;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_ticket_delete AFTER DELETE ON ticket BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 2;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_message_insert AFTER INSERT ON message BEGIN
+        INSERT INTO search_index(rowid, title, body, ticket_id, kind)
+        VALUES (new.id * 2 + 1, '', new.content, new.ticket_id, 'm');
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_message_update AFTER UPDATE OF content ON message BEGIN
+        UPDATE search_index SET body = new.content WHERE rowid = new.id * 2 + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_message_delete AFTER DELETE ON message BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 2 + 1;
+    END""",
+]
+
+REBUILD_SQL = [
+    "DELETE FROM search_index",
+    """INSERT INTO search_index(rowid, title, body, ticket_id, kind)
+       SELECT id * 2, title, description, id, 't' FROM ticket""",
+    """INSERT INTO search_index(rowid, title, body, ticket_id, kind)
+       SELECT id * 2 + 1, '', content, ticket_id, 'm' FROM message""",
+    "INSERT INTO search_index(search_index) VALUES ('optimize')",
+]
+
+# Заголовок весит больше описания и сообщений. MATERIALIZED не дает SQLite
+# развернуть подзапрос: bm25() и snippet() нельзя вызывать внутри агрегата
+SEARCH_SQL = """
+    WITH hits AS MATERIALIZED (
+        SELECT ticket_id, bm25(search_index, 10.0, 1.0) AS score,
+               snippet(search_index, 1, '', '', '…', 12) AS fragment
+        FROM search_index
+        WHERE search_index MATCH :match
+    )
+    SELECT ticket_id, MIN(score) AS score, fragment
+    FROM hits
+    GROUP BY ticket_id
+    ORDER BY score
+    LIMIT :limit OFFSET :offset
+"""
+
+
+def fts_available():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def ensure_search_index(conn):
+    # Создает индекс и триггеры; при первом создании заполняет его из существующих данных.
+    # Вызывается из миграции схемы (см. migrations.py)
+    if conn.dialect.name != 'sqlite':
+        return
+    existed = conn.execute(db.text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'")).first()
+    for statement in SEARCH_DDL:
+        conn.execute(db.text(statement))
+    if not existed:
+        for statement in REBUILD_SQL:
+            conn.execute(db.text(statement))
+
+
+def build_match(query):
+    # Пользовательский ввод не должен попадать в синтаксис FTS5: каждое слово
+    # берется в кавычки как префикс, слова объединяются через AND
+    terms = re.findall(r'\w+', query)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+class SearchResult:
+    def __init__(self, ticket, fragment):
+        self.ticket = ticket
+        self.fragment = fragment
+
+
+def search_tickets(query, page=1, per_page=15):
+    # Возвращает (результаты, есть_следующая_страница), отсортированные по релевантности
+    match = build_match(query)
+    if not match:
+        return [], False
+
+    offset = (page - 1) * per_page
+    if fts_available():
+        rows = db.session.execute(db.text(SEARCH_SQL),
+                                  {'match': match, 'limit': per_page + 1, 'offset': offset}).all()
+        hits = [(row.ticket_id, row.fragment) for row in rows]
+    else:
+        # Без FTS5 (например, PostgreSQL) — простой поиск по заголовку и описанию
+        pattern = f'%{query}%'
+        rows = (db.session.query(Ticket.id, Ticket.title)
+                .filter(db.or_(Ticket.title.ilike(pattern), Ticket.description.ilike(pattern)))
+                .order_by(Ticket.created_at.desc(), Ticket.id.desc())
+                .limit(per_page + 1).offset(offset).all())
+        hits = [(row.id, row.title) for row in rows]
+
+    has_next = len(hits) > per_page
+    hits = hits[:per_page]
+    tickets = {ticket.id: ticket for ticket in Ticket.query.filter(Ticket.id.in_([ticket_id for ticket_id, _ in hits]))}
+    results = [SearchResult(tickets[ticket_id], fragment) for ticket_id, fragment in hits if ticket_id in tickets]
+    return results, has_next
+
+
+search_cli = AppGroup('search', help='Полнотекстовый поиск.')
+
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    """Перестроить поисковый индекс с нуля."""
+    if not fts_available():
+        click.echo('FTS5 доступен только для SQLite')
+        return
+    with db.engine.begin() as conn:
+        ensure_search_index(conn)
+        for statement in REBUILD_SQL:
+            conn.execute(db.text(statement))
+    click.echo('Поисковый индекс перестроен')
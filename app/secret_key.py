@@ -0,0 +1,40 @@
+import os
+import secrets
+import tempfile
+
+
+def init_app(app):
+    # Один ключ на все процессы и перезапуски: SECRET_KEY из окружения, иначе
+    # файл ключа в instance-папке. Читается при создании приложения, а не при
+    # импорте конфигурации, и не зависит от текущего каталога
+    if not app.config['SECRET_KEY']:
+        path = os.path.join(app.instance_path, app.config['SECRET_KEY_FILE'])
+        app.config['SECRET_KEY'] = load_secret_key(path)
+
+
+def load_secret_key(path):
+    # Если файла нет, его создает первый процесс, а остальные читают уже
+    # записанный — сессии и flash работают в любом воркере
+    try:
+        with open(path, encoding='ascii') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    key = secrets.token_hex(32)
+    # Ключ пишется во временный файл (mkstemp создает его с правами 0600) и
+    # появляется под своим именем атомарно через link, уже заполненным
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='ascii') as f:
+            f.write(key)
+        os.link(tmp, path)
+    except FileExistsError:
+        # Файл только что создал соседний процесс — берем его ключ
+        with open(path, encoding='ascii') as f:
+            return f.read().strip()
+    finally:
+        os.remove(tmp)
+    return key
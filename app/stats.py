@@ -0,0 +1,215 @@
+import bisect
+from collections import defaultdict
+from datetime import date, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .extensions import db
+from .models import ArchivedTicket, StatsDaily, StatsHistogram, Ticket, TICKET_STATUSES
+
+# Верхние границы корзин гистограммы в секундах: от минуты до месяца
+BUCKET_BOUNDS = [60, 300, 900, 1800, 3600, 7200, 14400, 28800,
+                 86400, 172800, 345600, 604800, 1209600, 2592000]
+
+UPSERT_CHUNK_SIZE = 500  # Строк в одном многострочном INSERT
+
+
+def bucket_for(seconds):
+    return bisect.bisect_left(BUCKET_BOUNDS, seconds)
+
+
+class Rollup:
+    # Накопитель приращений; flush() записывает их одним upsert на таблицу
+    def __init__(self):
+        self.daily = defaultdict(lambda: defaultdict(float))
+        self.histogram = defaultdict(int)
+
+    def created(self, day):
+        self.daily[(day, 'Открыта')]['created'] += 1
+        self.daily[(day, 'Открыта')]['entered'] += 1
+
+    def moved(self, day, old_status, new_status):
+        if old_status == new_status:
+            return
+        if old_status:
+            self.daily[(day, old_status)]['left'] += 1
+        self.daily[(day, new_status)]['entered'] += 1
+
+    def duration(self, day, status, metric, seconds):
+        seconds = max(seconds, 0)
+        self.daily[(day, status)][f'{metric}_count'] += 1
+        self.daily[(day, status)][f'{metric}_seconds'] += seconds
+        self.histogram[(day, metric, bucket_for(seconds))] += 1
+
+    def replay(self, status, created_at, received_at, closed_at):
+        # История переходов не хранится, поэтому она восстанавливается по датам:
+        # создание -> получение -> закрытие -> текущий статус
+        self.created(created_at.date())
+        state, last = 'Открыта', created_at
+        if received_at is not None:
+            next_state = 'Закрыта' if closed_at is not None and closed_at <= received_at else 'В работе'
+            self.moved(received_at.date(), state, next_state)
+            self.duration(received_at.date(), next_state, 'receive', (received_at - created_at).total_seconds())
+            state, last = next_state, received_at
+        if closed_at is not None:
+            self.moved(closed_at.date(), state, 'Закрыта')
+            self.duration(closed_at.date(), 'Закрыта', 'close', (closed_at - created_at).total_seconds())
+            state, last = 'Закрыта', closed_at
+        if status and status != state:
+            self.moved(last.date(), state, status)  # Например, повторно открытая заявка
+
+    def flush(self):
+        daily_rows = [dict(day=day, status=status, **values) for (day, status), values in self.daily.items()]
+        histogram_rows = [dict(day=day, metric=metric, bucket=bucket, count=count)
+                          for (day, metric, bucket), count in self.histogram.items()]
+        upsert_add(StatsDaily, ('day', 'status'), daily_rows)
+        upsert_add(StatsHistogram, ('day', 'metric', 'bucket'), histogram_rows)
+        self.daily.clear()
+        self.histogram.clear()
+
+
+def upsert_add(model, keys, rows):
+    # INSERT ... ON CONFLICT DO UPDATE SET x = x + excluded.x: счетчики только прибавляются,
+    # поэтому параллельные процессы не теряют обновления друг друга
+    if not rows:
+        return
+    table = model.__table__
+    columns = [c.name for c in table.columns if c.name not in keys]
+    rows = [{column: row.get(column, 0) for column in columns} | {key: row[key] for key in keys} for row in rows]
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+            statement = insert(table).values(rows[start:start + UPSERT_CHUNK_SIZE])
+            statement = statement.on_conflict_do_update(
+                index_elements=list(keys),
+                set_={column: table.c[column] + statement.excluded[column] for column in columns})
+            db.session.execute(statement)
+        return
+
+    for row in rows:
+        condition = db.and_(*(table.c[key] == row[key] for key in keys))
+        updated = db.session.execute(table.update().where(condition).values(
+            {column: table.c[column] + row[column] for column in columns})).rowcount
+        if not updated:
+            db.session.execute(table.insert().values(row))
+
+
+def record_created(ticket):
+    rollup = Rollup()
+    rollup.created(ticket.created_at.date())
+    rollup.flush()
+
+
+def record_status_change(rows, new_status, now):
+    # rows — состояние заявок до UPDATE: (id, status, created_at, received_at, closed_at).
+    # Правила дат повторяют change_status()
+    rollup = Rollup()
+    day = now.date()
+    for row in rows:
+        rollup.moved(day, row.status, new_status)
+        if new_status in ('В работе', 'Закрыта') and row.received_at is None:
+            rollup.duration(day, new_status, 'receive', (now - row.created_at).total_seconds())
+        if new_status == 'Закрыта' and row.closed_at is None:
+            rollup.duration(day, new_status, 'close', (now - row.created_at).total_seconds())
+    rollup.flush()
+
+
+def percentile(histogram, fraction):
+    # Оценка перцентиля по корзинам: линейная интерполяция внутри корзины
+    total = sum(histogram)
+    if not total:
+        return None
+    target = fraction * total
+    seen = 0
+    for bucket, count in enumerate(histogram):
+        if count and seen + count >= target:
+            lower = BUCKET_BOUNDS[bucket - 1] if bucket > 0 else 0
+            upper = BUCKET_BOUNDS[bucket] if bucket < len(BUCKET_BOUNDS) else BUCKET_BOUNDS[-1] * 2
+            return lower + (upper - lower) * (target - seen) / count
+        seen += count
+    return None
+
+
+def sla_report(days=30, today=None):
+    # Читает только итоговые таблицы: O(дней), а не O(заявок)
+    today = today or date.today()
+    start = today - timedelta(days=days - 1)
+
+    # Остаток по статусам на начало периода — сумма приращений за все предыдущие дни
+    backlog = dict.fromkeys(TICKET_STATUSES, 0)
+    for status, entered, left in (db.session.query(StatsDaily.status, db.func.sum(StatsDaily.entered),
+                                                   db.func.sum(StatsDaily.left))
+                                  .filter(StatsDaily.day < start)
+                                  .group_by(StatsDaily.status)):
+        backlog[status] = backlog.get(status, 0) + (entered or 0) - (left or 0)
+
+    by_day = defaultdict(list)
+    for row in StatsDaily.query.filter(StatsDaily.day >= start, StatsDaily.day <= today):
+        by_day[row.day].append(row)
+
+    histograms = {'receive': [0] * (len(BUCKET_BOUNDS) + 1), 'close': [0] * (len(BUCKET_BOUNDS) + 1)}
+    for row in StatsHistogram.query.filter(StatsHistogram.day >= start, StatsHistogram.day <= today):
+        histograms[row.metric][row.bucket] += row.count
+
+    totals = defaultdict(float)
+    series = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        point = {'day': day.isoformat(), 'created': 0, 'received': 0, 'closed': 0}
+        for row in by_day.get(day, []):
+            backlog[row.status] = backlog.get(row.status, 0) + row.entered - row.left
+            point['created'] += row.created
+            point['received'] += row.receive_count
+            point['closed'] += row.close_count
+            for key in ('receive_count', 'receive_seconds', 'close_count', 'close_seconds'):
+                totals[key] += getattr(row, key)
+        point['backlog'] = {status: backlog.get(status, 0) for status in TICKET_STATUSES}
+        series.append(point)
+
+    def summary(metric):
+        count = totals[f'{metric}_count']
+        return {
+            'count': int(count),
+            'mean_seconds': totals[f'{metric}_seconds'] / count if count else None,
+            'p50_seconds': percentile(histograms[metric], 0.5),
+            'p90_seconds': percentile(histograms[metric], 0.9),
+            'p99_seconds': percentile(histograms[metric], 0.99),
+        }
+
+    return {
+        'from': start.isoformat(),
+        'to': today.isoformat(),
+        'time_to_receive': summary('receive'),
+        'time_to_close': summary('close'),
+        'open_backlog': sum(count for status, count in backlog.items() if status != 'Закрыта'),
+        'days': series,
+    }
+
+
+def rebuild(batch_size=1000):
+    # Полный пересчет по рабочей и архивной таблицам заявок
+    StatsDaily.query.delete()
+    StatsHistogram.query.delete()
+
+    rollup = Rollup()
+    for model in (Ticket, ArchivedTicket):
+        columns = (model.status, model.created_at, model.received_at, model.closed_at)
+        for status, created_at, received_at, closed_at in db.session.query(*columns).yield_per(batch_size):
+            rollup.replay(status, created_at, received_at, closed_at)
+
+    rollup.flush()
+    db.session.commit()
+
+
+stats_cli = AppGroup('stats', help='Статистика SLA.')
+
+
+@stats_cli.command('rebuild')
+def rebuild_command():
+    """Пересчитать суточные итоги по всем заявкам."""
+    rebuild()
+    click.echo('Статистика пересчитана')
@@ -0,0 +1,236 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import shutil
+import tempfile
+
+from flask import abort, current_app, request, send_file
+from werkzeug.security import safe_join
+
+try:
+    import zstandard
+except ImportError:  # zstandard — необязательная зависимость, без нее сжатие только gzip
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Сжатие при записи: блоб сжимаемого типа хранится как <digest>.gz или <digest>.zst
+# (digest — sha256 исходного содержимого). Картинки, PDF и архивы уже сжаты
+# и хранятся как есть
+SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+COMPRESSIBLE_TYPES = {'application/json', 'application/xml', 'application/x-ndjson', 'application/javascript',
+                      'application/sql', 'application/x-sh', 'image/svg+xml'}
+
+
+def is_compressible(mimetype):
+    return bool(mimetype) and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES)
+
+
+class BlobStorage:
+    # Хранилище вложений по содержимому: файл лежит один раз под своим sha256,
+    # а записи File ссылаются на него через digest
+    def __init__(self, root, chunk_size=64 * 1024, compression=None, min_compress_size=1024):
+        self.root = os.path.abspath(root)
+        self.chunk_size = chunk_size
+        self.compression = compression  # None, 'gzip' или 'zstd'
+        self.min_compress_size = min_compress_size
+
+    def path(self, digest):
+        return os.path.join(self.root, 'blobs', digest[:2], digest[2:4], digest)
+
+    def locate(self, digest):
+        # (путь, кодировка) сохраненного блоба; кодировка None — хранится без сжатия
+        path = self.path(digest)
+        if os.path.exists(path):
+            return path, None
+        for encoding, suffix in SUFFIXES.items():
+            if os.path.exists(path + suffix):
+                return path + suffix, encoding
+        return None, None
+
+    def exists(self, digest):
+        return self.locate(digest)[0] is not None
+
+    def open(self, digest):
+        # Поток исходного (распакованного) содержимого блоба
+        path, encoding = self.locate(digest)
+        if encoding == 'gzip':
+            return gzip.open(path, 'rb')
+        if encoding == 'zstd':
+            return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return open(path, 'rb')
+
+    def save(self, stream, mimetype=None):
+        staged = self.stage(stream)
+        return self._commit(staged['path'], staged['digest'], mimetype, staged['size']), staged['size']
+
+    def stage(self, stream):
+        # Поток пишется во временный файл кусками с одновременным подсчетом хэша,
+        # поэтому файл целиком в памяти не держится и ради хэша повторно не читается.
+        # В хранилище его переносит import_file() — сразу или в фоновой задаче
+        sha256 = hashlib.sha256()
+        size = 0
+        with self._tempfile() as tmp:
+            while True:
+                chunk = stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+        return {'path': tmp.name, 'digest': sha256.hexdigest(), 'size': size}
+
+    def digest_file(self, path):
+        sha256 = hashlib.sha256()
+        size = 0
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+                size += len(chunk)
+        return sha256.hexdigest(), size
+
+    def import_file(self, path, mimetype=None, digest=None, size=None):
+        # Переносит готовый файл в хранилище; digest и size можно передать,
+        # если они уже посчитаны (stage())
+        if digest is None:
+            digest, size = self.digest_file(path)
+        return self._commit(path, digest, mimetype, size), size
+
+    def _tempfile(self):
+        tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+
+    def _commit(self, tmp_path, digest, mimetype=None, size=0):
+        if self.exists(digest):
+            os.remove(tmp_path)  # Такой файл уже есть — дубликат не сохраняем
+            return digest
+
+        os.makedirs(os.path.dirname(self.path(digest)), exist_ok=True)
+        if self.compression and size >= self.min_compress_size and is_compressible(mimetype):
+            compressed = self._compress(tmp_path)
+            # Сжатие, которое почти ничего не дает, не стоит распаковки при каждой отдаче
+            if os.path.getsize(compressed) <= size * 0.9:
+                os.replace(compressed, self.path(digest) + SUFFIXES[self.compression])
+                os.remove(tmp_path)
+                return digest
+            os.remove(compressed)
+        os.replace(tmp_path, self.path(digest))
+        return digest
+
+    def _compress(self, source):
+        with open(source, 'rb') as src, self._tempfile() as tmp:
+            if self.compression == 'zstd':
+                with zstandard.ZstdCompressor(level=3).stream_writer(tmp, closefd=False) as writer:
+                    shutil.copyfileobj(src, writer, self.chunk_size)
+            else:
+                with gzip.GzipFile(fileobj=tmp, mode='wb', compresslevel=6, mtime=0) as writer:
+                    shutil.copyfileobj(src, writer, self.chunk_size)
+        return tmp.name
+
+    def legacy_path(self, ticket_id, filename):
+        # Файлы, загруженные до появления хранилища: uploads/<ticket_id>/<filename>
+        return os.path.join(self.root, str(ticket_id), filename)
+
+
+def get_storage():
+    compression = current_app.config['STORAGE_COMPRESSION'] or None
+    if compression == 'zstd' and zstandard is None:
+        logger.warning('zstandard не установлен, вложения сжимаются gzip')
+        compression = 'gzip'
+    return BlobStorage(current_app.config['UPLOAD_FOLDER'], current_app.config['STORAGE_CHUNK_SIZE'],
+                       compression, current_app.config['STORAGE_COMPRESS_MIN_SIZE'])
+
+
+def guess_mimetype(file):
+    if file.mimetype and file.mimetype != 'application/octet-stream':
+        return file.mimetype
+    return mimetypes.guess_type(file.filename)[0] or 'application/octet-stream'
+
+
+def send_path(path, root, **kwargs):
+    # Отдача файла с диска во всех режимах ATTACHMENT_DELIVERY. В режимах
+    # x-accel/x-sendfile байты отдает фронтовой сервер по своему заголовку
+    # (путь внутри root для nginx, абсолютный для Apache), а приложение —
+    # только заголовки; Range разбирает прокси, 304 — приложение
+    mode = current_app.config['ATTACHMENT_DELIVERY']
+    offload = mode in ('x-accel', 'x-sendfile')
+    response = send_file(path, conditional=not offload, **kwargs)
+    if offload:
+        response.make_conditional(request)
+    else:
+        response.accept_ranges = 'bytes'  # Сообщаем клиенту, что докачка поддерживается
+    if mode == 'x-accel':
+        del response.headers['X-Sendfile']
+        prefix = current_app.config['ATTACHMENT_ACCEL_PREFIX'].rstrip('/')
+        response.headers['X-Accel-Redirect'] = prefix + '/' + os.path.relpath(path, root).replace(os.sep, '/')
+    return response
+
+
+def _send_encoded(path, encoding, digest, filename, mimetype):
+    # Сжатый блоб уходит как есть с Content-Encoding. Отдает его само приложение
+    # (открытым файлом, а не путем): при X-Accel-Redirect nginx не сохраняет
+    # Content-Encoding ответа. Диапазоны считаются по сжатому представлению
+    response = send_file(open(path, 'rb'), mimetype=mimetype, as_attachment=True, download_name=filename,
+                         etag=f'{digest}-{encoding}', max_age=current_app.config['ATTACHMENT_MAX_AGE'],
+                         conditional=False)
+    response.content_encoding = encoding
+    response.content_length = os.path.getsize(path)
+    response.make_conditional(request, accept_ranges=True, complete_length=response.content_length)
+    return response
+
+
+def _send_decompressed(storage, digest, filename, mimetype, size):
+    # Клиент не принимает кодировку хранения — распаковываем на лету потоком.
+    # Диапазоны считаются по исходному содержимому: начало диапазона
+    # пропускается распаковкой. Без известного размера докачки нет
+    response = send_file(storage.open(digest), mimetype=mimetype, as_attachment=True, download_name=filename,
+                         etag=digest, max_age=current_app.config['ATTACHMENT_MAX_AGE'], conditional=False)
+    if size is None:
+        response.make_conditional(request)
+        return response
+    response.content_length = size
+    response.accept_ranges = 'bytes'
+    response.make_conditional(request, accept_ranges=True, complete_length=size)
+    return response
+
+
+def send_blob(storage, digest, filename, mimetype, size=None):
+    # sha256 содержимого — готовый сильный ETag; Range и 304 обрабатывает send_file.
+    # В режимах x-accel/x-sendfile байты отдает фронтовой сервер, а приложение
+    # отвечает только заголовками. Сжатый блоб отдается как есть с Content-Encoding,
+    # если клиент его принимает, иначе распаковывается на лету
+    path, encoding = storage.locate(digest)
+    if path is None:
+        abort(404)
+    if encoding is not None:
+        if request.accept_encodings[encoding]:
+            response = _send_encoded(path, encoding, digest, filename, mimetype)
+        else:
+            response = _send_decompressed(storage, digest, filename, mimetype, size)
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.vary.add('Accept-Encoding')
+        return response
+
+    response = send_path(path, storage.root, mimetype=mimetype, as_attachment=True, download_name=filename,
+                         etag=digest, max_age=current_app.config['ATTACHMENT_MAX_AGE'])
+    response.cache_control.public = False
+    response.cache_control.private = True  # Вложения заявок не должны оседать в общих кэшах
+    return response
+
+
+def send_legacy(storage, ticket_id, filename):
+    path = safe_join(os.path.join(storage.root, str(ticket_id)), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    response = send_path(path, storage.root, as_attachment=True, download_name=filename,
+                         max_age=current_app.config['ATTACHMENT_MAX_AGE'])
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
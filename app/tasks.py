@@ -1,43 +1,44 @@
-from celery import shared_task
-from models import db, Ticket, File
-import os
-from datetime import datetime
-
-@shared_task
-def create_ticket_task(ticket_data, file_paths):
-    # Создаем новый объект заявки
-    new_ticket = Ticket(
-        created_at=datetime.now(),
-        title=ticket_data['title'],
-        description=ticket_data['description'],
-        status="Открыта",
-        pc_name=ticket_data['pc_name'],
-        ip_address=ticket_data['ip_address'],
-        is_new=True
+# Необязательный бэкенд очереди на Celery/Redis (JOBS_BACKEND='celery').
+# Задачи выполняют те же обработчики, что и локальные воркеры из jobs.py
+from celery import Celery, Task, shared_task
+
+from .jobs import run_job
+
+
+def celery_init_app(app):
+    class FlaskTask(Task):
+        def __call__(self, *args, **kwargs):
+            with app.app_context():
+                return self.run(*args, **kwargs)
+
+    celery_app = Celery(app.name, task_cls=FlaskTask)
+    celery_app.conf.update(
+        broker_url=app.config['CELERY_BROKER_URL'],
+        result_backend=app.config['CELERY_RESULT_BACKEND'],
+        task_acks_late=True,
     )
-    
-    # Сохраняем заявку в базе данных
-    db.session.add(new_ticket)
-    db.session.commit()  # Здесь мы фиксируем изменения, чтобы получить ID
-
-    # Создание уникального каталога для файлов заявки
-    ticket_folder = os.path.join('uploads', str(new_ticket.id))  # Убедитесь, что путь правильный
-    os.makedirs(ticket_folder, exist_ok=True)  # Создаем каталог, если он не существует
-
-    # Обработка загруженных файлов
-    for file_path in file_paths:
-        # Сохраняем информацию о файле в базе данных
-        filename = os.path.basename(file_path)
-        new_file = File(filename=filename, ticket_id=new_ticket.id)
-        db.session.add(new_file)
-
-    db.session.commit()  # Фиксируем изменения в базе данных
-
-
-@shared_task
-def update_ticket_task(ticket_id, updated_data):
-    ticket = Ticket.query.get(ticket_id)
-    if ticket:
-        for key, value in updated_data.items():
-            setattr(ticket, key, value)
-        db.session.commit()
+    celery_app.set_default()
+    app.extensions['celery'] = celery_app
+    return celery_app
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=5)
+def create_ticket_task(self, ticket_id, files):
+    try:
+        run_job('create_ticket', {'ticket_id': ticket_id, 'files': files})
+    except Exception as exc:
+        raise self.retry(exc=exc)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=5)
+def make_previews_task(self, files):
+    try:
+        run_job('make_previews', {'files': files})
+    except Exception as exc:
+        raise self.retry(exc=exc)
+
+
+TASKS = {
+    'create_ticket': create_ticket_task,
+    'make_previews': make_previews_task,
+}
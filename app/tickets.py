@@ -0,0 +1,81 @@
+from datetime import datetime
+
+from .extensions import db
+from .counters import count_status_change
+from .models import Ticket, TICKET_STATUSES
+from .stats import record_status_change
+
+# Сколько id передавать в одном IN (...), чтобы не упереться в лимит параметров SQLite
+ID_CHUNK_SIZE = 500
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        yield ids[start:start + ID_CHUNK_SIZE]
+
+
+def mark_seen(tickets):
+    # Снимаем флаг is_new одним UPDATE; если новых заявок нет — ни запроса, ни commit
+    ids = [ticket.id for ticket in tickets if ticket.is_new]
+    if not ids:
+        return 0
+
+    count = (Ticket.query
+             .filter(Ticket.id.in_(ids), Ticket.is_new.is_(True))
+             .update({Ticket.is_new: False}, synchronize_session=False))
+    db.session.commit()
+    return count
+
+
+def bump_version(ticket_ids):
+    # Отмечает изменение заявок: закэшированные фрагменты со старой версией
+    # больше не используются. Фиксируется вместе с изменением вызывающего кода
+    for chunk in _chunks(ticket_ids):
+        (Ticket.query
+         .filter(Ticket.id.in_(chunk))
+         .update({Ticket.version: Ticket.version + 1}, synchronize_session=False))
+
+
+def with_children(ticket_ids):
+    # Добавляет к инцидентам присоединенные к ним заявки (см. intake.py)
+    ids = list(ticket_ids)
+    seen = set(ids)
+    children = []
+    for chunk in _chunks(ids):
+        for row in db.session.query(Ticket.id).filter(Ticket.parent_id.in_(chunk)):
+            if row.id not in seen:
+                seen.add(row.id)
+                children.append(row.id)
+    return ids + children
+
+
+def change_status(ticket_ids, new_status):
+    # Меняет статус сразу у многих заявок в одной транзакции.
+    # Даты ставятся по тем же правилам, что и раньше в update_ticket:
+    # "В работе" — дата получения, "Закрыта" — даты получения и закрытия, если их еще нет.
+    # Присоединенные к инцидентам заявки меняют статус вместе с ними
+    if new_status not in TICKET_STATUSES:
+        raise ValueError(new_status)
+
+    now = datetime.now()
+    values = {Ticket.status: new_status, Ticket.version: Ticket.version + 1}
+    if new_status == 'В работе':
+        values[Ticket.received_at] = db.func.coalesce(Ticket.received_at, now)
+    elif new_status == 'Закрыта':
+        values[Ticket.received_at] = db.func.coalesce(Ticket.received_at, now)
+        values[Ticket.closed_at] = db.func.coalesce(Ticket.closed_at, now)
+
+    count = 0
+    for chunk in _chunks(with_children(ticket_ids)):
+        # Состояние до изменения нужно для инкрементальной статистики SLA и счетчиков
+        before = (db.session.query(Ticket.id, Ticket.status, Ticket.created_at, Ticket.received_at,
+                                   Ticket.closed_at, Ticket.ip_address, Ticket.pc_name, Ticket.parent_id)
+                  .filter(Ticket.id.in_(chunk)).all())
+        count += (Ticket.query
+                  .filter(Ticket.id.in_(chunk))
+                  .update(values, synchronize_session=False))
+        record_status_change(before, new_status, now)
+        count_status_change(before, new_status)
+    db.session.commit()
+    return count
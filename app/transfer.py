@@ -0,0 +1,258 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from .counters import Counts
+from .extensions import db
+from .models import File, Message, Ticket
+from .stats import Rollup
+
+# Выгрузка и загрузка заявок вместе с сообщениями и метаданными файлов.
+# JSONL — одна заявка на строку со вложенными messages и files; CSV — плоская
+# таблица tickets, messages или files
+
+TICKET_COLUMNS = ['id', 'created_at', 'received_at', 'closed_at', 'title', 'description',
+                  'status', 'pc_name', 'ip_address', 'is_new', 'version', 'parent_id']
+MESSAGE_COLUMNS = ['id', 'ticket_id', 'ip_address', 'pc_name', 'content', 'created_at']
+FILE_COLUMNS = ['id', 'ticket_id', 'filename', 'digest', 'size', 'mimetype']
+DATE_COLUMNS = {'created_at', 'received_at', 'closed_at'}
+INTEGER_COLUMNS = {'id', 'ticket_id', 'size', 'version', 'parent_id'}  # В CSV приходят строками
+OPTIONAL_COLUMNS = {'version', 'parent_id'}  # Их нет в выгрузках старых версий
+
+CSV_TABLES = {
+    'tickets': (Ticket, TICKET_COLUMNS),
+    'messages': (Message, MESSAGE_COLUMNS),
+    'files': (File, FILE_COLUMNS),
+}
+
+
+def _dump(obj, columns):
+    row = {}
+    for column in columns:
+        value = getattr(obj, column)
+        row[column] = value.isoformat() if isinstance(value, datetime) else value
+    return row
+
+
+def _load(row, columns):
+    values = {}
+    for column in columns:
+        value = row.get(column)
+        if value == '':
+            value = None
+        if value is not None and column in DATE_COLUMNS:
+            value = datetime.fromisoformat(value)
+        elif value is not None and column in INTEGER_COLUMNS:
+            value = int(value)
+        values[column] = value
+    return values
+
+
+def _stream(model, batch_size):
+    # Серверный курсор: строки приходят пачками по batch_size, память не растет с размером таблицы
+    statement = db.select(model).order_by(model.id).execution_options(yield_per=batch_size)
+    return db.session.execute(statement).scalars().partitions()
+
+
+def export_jsonl(batch_size):
+    for tickets in _stream(Ticket, batch_size):
+        ids = [ticket.id for ticket in tickets]
+        messages, files = {}, {}
+        for message in Message.query.filter(Message.ticket_id.in_(ids)).order_by(Message.id):
+            messages.setdefault(message.ticket_id, []).append(_dump(message, MESSAGE_COLUMNS))
+        for file in File.query.filter(File.ticket_id.in_(ids)).order_by(File.id):
+            files.setdefault(file.ticket_id, []).append(_dump(file, FILE_COLUMNS))
+
+        lines = []
+        for ticket in tickets:
+            row = _dump(ticket, TICKET_COLUMNS)
+            row['messages'] = messages.get(ticket.id, [])
+            row['files'] = files.get(ticket.id, [])
+            lines.append(json.dumps(row, ensure_ascii=False) + '\n')
+        db.session.expunge_all()  # Отпускаем выгруженные объекты из identity map
+        yield ''.join(lines)
+
+
+def export_csv(table, batch_size):
+    model, columns = CSV_TABLES[table]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    for rows in _stream(model, batch_size):
+        for row in rows:
+            writer.writerow(_dump(row, columns))
+        db.session.expunge_all()
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _insert_batch(tickets, keep_ids, incident_ids):
+    # Одна транзакция на пачку: заявки одним INSERT ... RETURNING, затем
+    # сообщения и файлы через executemany с уже известными id заявок.
+    # Без keep_ids заявки получают новые id, и parent_id переводится на них
+    # через incident_ids (исходный id инцидента -> новый). Инцидент выгружен
+    # раньше своих дочерних заявок; из той же пачки он известен только после
+    # INSERT, поэтому такие parent_id проставляются отдельным UPDATE
+    ticket_columns = TICKET_COLUMNS if keep_ids else TICKET_COLUMNS[1:]
+    ticket_rows = [{column: ticket[column] for column in ticket_columns} for ticket in tickets]
+    if not keep_ids:
+        for row in ticket_rows:
+            if row['parent_id'] is not None:
+                row['parent_id'] = incident_ids.get(row['parent_id'])
+    ids = db.session.scalars(
+        db.insert(Ticket).returning(Ticket.id, sort_by_parameter_order=True), ticket_rows).all()
+
+    if not keep_ids:
+        for ticket_id, ticket in zip(ids, tickets):
+            if ticket['parent_id'] is None and ticket['id'] is not None:
+                incident_ids[ticket['id']] = ticket_id
+        parents = []
+        for ticket_id, ticket, row in zip(ids, tickets, ticket_rows):
+            if ticket['parent_id'] is not None and row['parent_id'] is None:
+                # Инцидент из этой же пачки; если его нет в выгрузке, заявка остается самостоятельной
+                row['parent_id'] = incident_ids.get(ticket['parent_id'])
+                if row['parent_id'] is not None:
+                    parents.append({'id': ticket_id, 'parent_id': row['parent_id']})
+        if parents:
+            db.session.execute(db.update(Ticket), parents)
+
+    message_rows, file_rows = [], []
+    rollup = Rollup()
+    counts = Counts()
+    for ticket_id, ticket, row in zip(ids, tickets, ticket_rows):
+        rollup.replay(ticket['status'], ticket['created_at'], ticket['received_at'], ticket['closed_at'])
+        counts.add(ticket['ip_address'], ticket['pc_name'], ticket['status'], incident=row['parent_id'] is None)
+        for message in ticket['messages']:
+            message_rows.append(dict(message, ticket_id=ticket_id))
+        for file in ticket['files']:
+            file_rows.append(dict(file, ticket_id=ticket_id))
+
+    if not keep_ids:
+        for row in message_rows + file_rows:
+            row.pop('id', None)
+    if message_rows:
+        db.session.execute(db.insert(Message), message_rows)
+    if file_rows:
+        db.session.execute(db.insert(File), file_rows)
+    rollup.flush()
+    counts.flush()
+    db.session.commit()
+
+
+def _ticket(row):
+    ticket = _load(row, TICKET_COLUMNS)
+    if ticket['version'] is None:
+        ticket['version'] = 0  # Выгрузки до появления версии
+    return ticket
+
+
+def _read_jsonl(stream):
+    for line in stream:
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        ticket = _ticket(row)
+        ticket['messages'] = [_load(message, MESSAGE_COLUMNS) for message in row.get('messages', [])]
+        ticket['files'] = [_load(file, FILE_COLUMNS) for file in row.get('files', [])]
+        yield ticket
+
+
+def _csv_rows(stream, columns):
+    reader = csv.DictReader(stream)
+    missing = [column for column in columns
+               if column not in (reader.fieldnames or []) and column not in OPTIONAL_COLUMNS]
+    if missing:
+        raise ValueError(f'В CSV нет колонок {", ".join(missing)} — это выгрузка другой таблицы?')
+    return reader
+
+
+def _read_csv(stream):
+    for row in _csv_rows(stream, TICKET_COLUMNS):
+        ticket = _ticket(row)
+        ticket['is_new'] = str(ticket['is_new']).lower() in ('1', 'true')
+        ticket['messages'] = []
+        ticket['files'] = []
+        yield ticket
+
+
+def import_tickets(stream, fmt, batch_size, keep_ids=False):
+    reader = _read_jsonl(stream) if fmt == 'jsonl' else _read_csv(stream)
+    batch, total = [], 0
+    incident_ids = {}
+    for ticket in reader:
+        batch.append(ticket)
+        if len(batch) >= batch_size:
+            _insert_batch(batch, keep_ids, incident_ids)
+            total += len(batch)
+            batch = []
+    if batch:
+        _insert_batch(batch, keep_ids, incident_ids)
+        total += len(batch)
+    return total
+
+
+def import_rows(stream, table, batch_size, keep_ids=False):
+    # CSV сообщений или файлов. ticket_id берется как есть, поэтому заявки
+    # должны быть загружены раньше с keep_ids
+    model, columns = CSV_TABLES[table]
+    if not keep_ids:
+        columns = columns[1:]
+    batch, total = [], 0
+    for row in _csv_rows(stream, columns):
+        batch.append(_load(row, columns))
+        if len(batch) >= batch_size:
+            db.session.execute(db.insert(model), batch)
+            db.session.commit()
+            total += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(model), batch)
+        db.session.commit()
+        total += len(batch)
+    return total
+
+
+tickets_cli = AppGroup('tickets', help='Выгрузка и загрузка заявок.')
+
+
+@tickets_cli.command('export')
+@click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv']), default='jsonl', show_default=True)
+@click.option('--table', type=click.Choice(list(CSV_TABLES)), default='tickets', show_default=True,
+              help='Таблица для CSV.')
+@click.option('--batch-size', type=int, default=None, help='Строк на пачку серверного курсора.')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-', show_default=True)
+def export_command(fmt, table, batch_size, output):
+    """Выгрузить заявки потоком в JSONL или CSV."""
+    batch_size = batch_size or current_app.config['EXPORT_BATCH_SIZE']
+    chunks = export_jsonl(batch_size) if fmt == 'jsonl' else export_csv(table, batch_size)
+    for chunk in chunks:
+        output.write(chunk)
+
+
+@tickets_cli.command('import')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv']), default='jsonl', show_default=True)
+@click.option('--table', type=click.Choice(list(CSV_TABLES)), default='tickets', show_default=True,
+              help='Таблица для CSV; сообщения и файлы — после заявок, загруженных с --keep-ids.')
+@click.option('--batch-size', type=int, default=None, help='Строк в одной транзакции.')
+@click.option('--keep-ids', is_flag=True, help='Сохранить исходные id (перенос в пустую БД).')
+def import_command(source, fmt, table, batch_size, keep_ids):
+    """Загрузить заявки пачками из JSONL (с сообщениями и файлами) или CSV."""
+    batch_size = batch_size or current_app.config['IMPORT_BATCH_SIZE']
+    if fmt == 'jsonl' and table != 'tickets':
+        raise click.UsageError('--table используется только с --format csv')
+    try:
+        if table == 'tickets':
+            total = import_tickets(source, fmt, batch_size, keep_ids)
+        else:
+            total = import_rows(source, table, batch_size, keep_ids)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    click.echo(f'Загружено строк: {total}' if table != 'tickets' else f'Загружено заявок: {total}')
@@ -0,0 +1,135 @@
+import io
+import itertools
+import threading
+import time
+
+from app.models import File, Ticket
+from app.pagination import encode_cursor
+
+
+def percentile(values, fraction):
+    # Ближайший ранг по отсортированному списку
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize(latencies, errors, wall):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'count': count,
+        'errors': errors,
+        'throughput_rps': round(count / wall, 2) if wall else None,
+        'mean_ms': ms(sum(latencies) / count) if count else None,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'max_ms': ms(latencies[-1]) if count else None,
+    }
+
+
+class Scenarios:
+    # Запросы к маршрутам; каждый сценарий получает клиента и генератор случайных чисел
+    def __init__(self, app, rng):
+        with app.app_context():
+            self.ticket_ids = [row.id for row in Ticket.query.with_entities(Ticket.id)]
+            self.files = [(row.ticket_id, row.filename)
+                          for row in File.query.with_entities(File.ticket_id, File.filename).limit(1000)]
+            per_page = app.config['PAGINATION_PER_PAGE']
+            pages = max(len(self.ticket_ids) // per_page, 1)
+            self.deep_page = max(pages - 1, 1)
+            # Курсор, указывающий на ту же глубину, что и deep_page
+            deep = (Ticket.query.order_by(Ticket.created_at.desc(), Ticket.id.desc())
+                    .offset((self.deep_page - 1) * per_page).first())
+            self.deep_cursor = encode_cursor(deep, 'next') if deep else None
+        self.rng = rng
+        self.lock = threading.Lock()
+        self.submitted = itertools.count(1)
+
+    def _choice(self, items):
+        with self.lock:
+            return self.rng.choice(items)
+
+    def submit(self, client):
+        # Номер делает каждую заявку уникальной, иначе прием отсекает их как повторы (INTAKE_DEDUP_TTL)
+        with self.lock:
+            number = next(self.submitted)
+        data = {'title': f'Нагрузочный тест {number}', 'description': f'Проверка скорости приема заявок №{number}'}
+        if self._choice([True, False, False]):
+            data['files'] = [(io.BytesIO(b'x' * 32 * 1024), 'bench.txt')]
+        return client.post('/ticket', data=data, content_type='multipart/form-data')
+
+    def admin_shallow(self, client):
+        return client.get('/admin')
+
+    def admin_deep_offset(self, client):
+        return client.get(f'/admin?page={self.deep_page}')
+
+    def admin_deep_cursor(self, client):
+        return client.get('/admin', query_string={'cursor': self.deep_cursor} if self.deep_cursor else None)
+
+    def view_ticket(self, client):
+        return client.get(f'/ticket/{self._choice(self.ticket_ids)}')
+
+    def check_new_tickets(self, client):
+        return client.get('/check_new_tickets')
+
+    def download(self, client):
+        if not self.files:
+            return None
+        ticket_id, filename = self._choice(self.files)
+        return client.get(f'/uploads/{ticket_id}/{filename}')
+
+    names = ['submit', 'admin_shallow', 'admin_deep_offset', 'admin_deep_cursor',
+             'view_ticket', 'check_new_tickets', 'download']
+
+
+def login(client, username='admin', password='admin'):
+    client.post('/login', data={'username': username, 'password': password})
+
+
+def run_scenario(app, scenario, clients, requests, warmup=5):
+    # requests запросов делятся между clients потоками, у каждого свой клиент и сессия
+    per_client = [requests // clients + (1 if i < requests % clients else 0) for i in range(clients)]
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients + 1)
+
+    def worker(count):
+        client = app.test_client()
+        login(client)
+        for _ in range(warmup):
+            _close(scenario(client))
+        barrier.wait()
+        local = []
+        failed = 0
+        for _ in range(count):
+            started = time.perf_counter()
+            response = scenario(client)
+            if response is not None:
+                response.get_data()  # Тело читается целиком, как это сделал бы браузер
+                if response.status_code >= 400:
+                    failed += 1
+                response.close()
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(count,)) for count in per_client]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+
+def _close(response):
+    if response is not None:
+        response.get_data()
+        response.close()
@@ -0,0 +1,116 @@
+# Нагрузочный прогон маршрутов app/routes.py без сети и внешних сервисов.
+#
+#   python -m bench.run --tickets 20000 --clients 8 --requests 400 --output bench.json
+#   python -m bench.run --tickets 20000 --output new.json --compare bench.json
+#
+# БД и вложения создаются во временном каталоге (или в --workdir, чтобы
+# переиспользовать засеянные данные между прогонами с --reuse)
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный тест системы заявок')
+    parser.add_argument('--tickets', type=int, default=5000, help='Сколько заявок засеять')
+    parser.add_argument('--clients', type=int, default=4, help='Параллельных клиентов')
+    parser.add_argument('--requests', type=int, default=200, help='Запросов на маршрут')
+    parser.add_argument('--routes', nargs='*', help='Только эти сценарии')
+    parser.add_argument('--seed', type=int, default=42, help='Зерно генератора случайных чисел')
+    parser.add_argument('--workdir', help='Каталог для БД и вложений (по умолчанию временный)')
+    parser.add_argument('--reuse', action='store_true', help='Не засеивать, если БД в --workdir уже есть')
+    parser.add_argument('--output', help='Куда сохранить JSON-отчет')
+    parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+    return parser.parse_args(argv)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_report(report, baseline=None):
+    header = f"{'маршрут':<20}{'rps':>10}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'ошибки':>8}"
+    if baseline:
+        header += f"{'Δp95':>10}"
+    print(header)
+    for name, result in report['routes'].items():
+        line = (f"{name:<20}{result['throughput_rps'] or 0:>10.1f}{result['p50_ms'] or 0:>10.2f}"
+                f"{result['p95_ms'] or 0:>10.2f}{result['p99_ms'] or 0:>10.2f}{result['errors']:>8}")
+        previous = (baseline or {}).get('routes', {}).get(name)
+        if previous and previous.get('p95_ms') and result['p95_ms']:
+            line += f"{(result['p95_ms'] / previous['p95_ms'] - 1) * 100:>+9.1f}%"
+        print(line)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='ticket-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    database = os.path.join(workdir, 'bench.db')
+    seeded = args.reuse and os.path.exists(database)
+
+    # Конфигурация читает окружение при импорте, поэтому приложение импортируется после
+    os.environ['DATABASE_URL'] = 'sqlite:///' + database
+    os.environ['SCHEMA_AUTO_UPGRADE'] = '1'  # Один процесс — схему можно обновить при старте
+    from app import create_app
+    from app.extensions import db
+    from bench.driver import Scenarios, run_scenario
+    from bench.seed import seed
+
+    app = create_app()
+    app.config.update(UPLOAD_FOLDER=os.path.join(workdir, 'uploads'), WTF_CSRF_ENABLED=False)
+    rng = random.Random(args.seed)
+
+    if not seeded:
+        started = time.perf_counter()
+        with app.app_context():
+            seed(args.tickets, rng)
+        print(f'Засеяно {args.tickets} заявок за {time.perf_counter() - started:.1f} с', file=sys.stderr)
+
+    with app.app_context():
+        from app.models import Ticket
+        tickets = db.session.query(db.func.count(Ticket.id)).scalar()
+
+    scenarios = Scenarios(app, rng)
+    names = args.routes or Scenarios.names
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': app.config['SQLALCHEMY_DATABASE_URI'],
+            'tickets': tickets,
+            'clients': args.clients,
+            'requests': args.requests,
+            'seed': args.seed,
+        },
+        'routes': {},
+    }
+    for name in names:
+        report['routes'][name] = run_scenario(app, getattr(scenarios, name), args.clients, args.requests)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import io
+from datetime import datetime, timedelta
+
+from app.counters import rebuild as rebuild_counters
+from app.extensions import db
+from app.models import File, Message, Role, Ticket, User
+from app.stats import rebuild as rebuild_stats
+from app.storage import get_storage
+
+# Генератор правдоподобных данных для нагрузочных прогонов.
+# Все случайности идут через переданный random.Random, поэтому прогон воспроизводим
+
+TOPICS = [
+    ('Не печатает принтер', 'Принтер в кабинете {room} не печатает, в очереди висят задания.'),
+    ('Нет доступа к сетевой папке', 'Не открывается \\\\fs01\\{room}, пишет "нет доступа".'),
+    ('Не приходит почта', 'С утра не приходят письма, Outlook просит пароль.'),
+    ('Медленно работает компьютер', 'Компьютер {room} долго загружается и зависает.'),
+    ('Не работает интернет', 'В кабинете {room} нет интернета, сетевой значок с восклицательным знаком.'),
+    ('Установить программу', 'Прошу установить программу для работы с PDF на ПК {room}.'),
+    ('Сломалась мышь', 'Мышь не реагирует, замена батареек не помогла.'),
+    ('1С не запускается', 'При запуске 1С ошибка подключения к серверу.'),
+]
+REPLIES = ['Принято в работу', 'Перезагрузите компьютер, пожалуйста', 'Проверили, проблема на сервере',
+           'Уже лучше, спасибо', 'Все еще не работает', 'Заменили картридж', 'Закрываю заявку']
+ATTACHMENTS = [('screenshot.png', 'image/png'), ('error.txt', 'text/plain'), ('scan.pdf', 'application/pdf'),
+               ('photo.jpg', 'image/jpeg')]
+
+
+def working_time(rng, start, days):
+    # Заявки приходят в рабочие часы будних дней
+    while True:
+        moment = start + timedelta(days=rng.randrange(days), hours=rng.triangular(8, 18, 10),
+                                   seconds=rng.randrange(3600))
+        if moment.weekday() < 5:
+            return moment
+
+
+def ensure_admin(username='admin', password='admin'):
+    role = Role.query.filter_by(name='admin').first()
+    if role is None:
+        role = Role(name='admin')
+        db.session.add(role)
+        db.session.add(Role(name='user'))
+        db.session.flush()
+    if User.query.filter_by(username=username).first() is None:
+        db.session.add(User(username=username, password=password, role_id=role.id))
+    db.session.commit()
+
+
+def make_blobs(rng, count):
+    # Небольшой пул вложений: одни и те же скриншоты прикладывают к разным заявкам
+    storage = get_storage()
+    blobs = []
+    for _ in range(count):
+        filename, mimetype = rng.choice(ATTACHMENTS)
+        size = min(int(rng.lognormvariate(10, 1.2)), 2 * 1024 * 1024)
+        payload = rng.randbytes(size)
+        digest, size = storage.save(io.BytesIO(payload))
+        blobs.append((filename, mimetype, digest, size))
+    return blobs
+
+
+def seed(tickets, rng, days=365, batch_size=1000, messages_mean=3.0, files_share=0.3, blob_pool=50):
+    ensure_admin()
+    blobs = make_blobs(rng, blob_pool)
+    start = datetime.now() - timedelta(days=days)
+
+    ticket_rows = []
+    for _ in range(tickets):
+        title, description = rng.choice(TOPICS)
+        created_at = working_time(rng, start, days)
+        roll = rng.random()
+        received_at = closed_at = None
+        if roll < 0.9:
+            received_at = created_at + timedelta(seconds=rng.lognormvariate(8, 1.5))  # ~50 мин медиана
+        if roll < 0.7:
+            closed_at = received_at + timedelta(seconds=rng.lognormvariate(10, 1.5))  # ~6 ч медиана
+        status = 'Закрыта' if closed_at else 'В работе' if received_at else 'Открыта'
+        ticket_rows.append({
+            'created_at': created_at,
+            'received_at': received_at,
+            'closed_at': closed_at,
+            'title': title,
+            'description': description.format(room=rng.randrange(100, 500)),
+            'status': status,
+            'pc_name': f'PC-{rng.randrange(1, 400):03d}',
+            'ip_address': f'10.0.{rng.randrange(0, 4)}.{rng.randrange(1, 255)}',
+            'is_new': status == 'Открыта',
+        })
+    ticket_rows.sort(key=lambda row: row['created_at'])
+
+    for offset in range(0, len(ticket_rows), batch_size):
+        batch = ticket_rows[offset:offset + batch_size]
+        ids = db.session.scalars(
+            db.insert(Ticket).returning(Ticket.id, sort_by_parameter_order=True), batch).all()
+        message_rows, file_rows = [], []
+        for ticket_id, row in zip(ids, batch):
+            moment = row['created_at']
+            for _ in range(int(rng.expovariate(1 / messages_mean))):
+                moment += timedelta(seconds=rng.expovariate(1 / 3600))
+                message_rows.append({'ticket_id': ticket_id, 'ip_address': row['ip_address'],
+                                     'pc_name': row['pc_name'], 'content': rng.choice(REPLIES),
+                                     'created_at': moment})
+            if rng.random() < files_share:
+                for filename, mimetype, digest, size in rng.sample(blobs, rng.randint(1, 2)):
+                    file_rows.append({'ticket_id': ticket_id, 'filename': filename, 'digest': digest,
+                                      'size': size, 'mimetype': mimetype})
+        if message_rows:
+            db.session.execute(db.insert(Message), message_rows)
+        if file_rows:
+            db.session.execute(db.insert(File), file_rows)
+        db.session.commit()
+
+    # Заявки вставлены в обход count_created — счетчики пересчитываются целиком
+    with db.engine.begin() as conn:
+        rebuild_counters(conn)
+    rebuild_stats(batch_size)
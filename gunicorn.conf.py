@@ -0,0 +1,37 @@
+import multiprocessing
+import os
+
+# Настройки gunicorn для боевого запуска: gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Несколько процессов работают корректно, потому что:
+#   - SECRET_KEY общий (переменная SECRET_KEY или файл SECRET_KEY_FILE),
+#     сессии и flash подписаны одним ключом в любом воркере;
+#   - пул соединений БД сбрасывается в дочернем процессе после fork;
+#   - long-poll /new_tickets перепроверяет БД, а не только ждет сигнала
+#     своего процесса (NEW_TICKETS_RECHECK);
+#   - задачу из таблицы job забирает условный UPDATE — ровно один воркер;
+#     пул потоков очереди поднимается с первым запросом, уже после fork.
+# Кэш фрагментов и метрики у каждого воркера свои.
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+
+# Процессы — по ядрам, потоки внутри процесса — для long-poll и ожидания БД
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+
+# Приложение импортируется один раз до fork: воркеры стартуют быстрее и делят память
+preload_app = True
+
+# Плавная замена воркеров: после max_requests (± jitter, чтобы не все сразу)
+# воркер дообслуживает текущие запросы и перезапускается
+max_requests = int(os.environ.get('MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('MAX_REQUESTS_JITTER', 200))
+graceful_timeout = 30
+
+# Больше, чем NEW_TICKETS_POLL_TIMEOUT, иначе ждущий long-poll убьют как зависший
+timeout = 60
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
@@ -1,6 +1,10 @@
 from app import create_app
+from app.migrations import upgrade
 
 app = create_app()
 
 if __name__ == '__main__':
+    # Отладочный сервер — один процесс, можно обновить схему прямо здесь
+    with app.app_context():
+        upgrade()
     app.run(debug=True)
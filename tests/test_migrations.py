@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+os.environ.setdefault('SECRET_KEY', 'test')
+
+from app import create_app
+from app.config import Config
+from app.extensions import db
+from app.migrations import LATEST_VERSION, current_version, upgrade
+
+# Обновление схемы до последней версии с каждой предыдущей. БД версии N
+# строится миграциями 1..N, версия 0 — БД, созданная create_all исходных
+# моделей до появления версий
+
+LEGACY_DDL = [
+    'CREATE TABLE role (id INTEGER PRIMARY KEY, name VARCHAR(50) UNIQUE)',
+    'CREATE TABLE user (id INTEGER PRIMARY KEY, username VARCHAR(150) NOT NULL UNIQUE, '
+    'password VARCHAR(150) NOT NULL, role_id INTEGER REFERENCES role (id))',
+    'CREATE TABLE ticket (id INTEGER PRIMARY KEY, created_at DATETIME NOT NULL, received_at DATETIME, '
+    'closed_at DATETIME, title VARCHAR(150) NOT NULL, description TEXT NOT NULL, status VARCHAR(50), '
+    'pc_name VARCHAR(150), ip_address VARCHAR(50), is_new BOOLEAN)',
+    'CREATE TABLE message (id INTEGER PRIMARY KEY, ticket_id INTEGER NOT NULL REFERENCES ticket (id), '
+    'ip_address VARCHAR(45) NOT NULL, pc_name VARCHAR(255) NOT NULL, content TEXT NOT NULL, created_at DATETIME)',
+    'CREATE TABLE file (id INTEGER PRIMARY KEY, filename VARCHAR(150) NOT NULL, '
+    'ticket_id INTEGER NOT NULL REFERENCES ticket (id))',
+]
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'SQLALCHEMY_DATABASE_URI', 'sqlite:///' + str(tmp_path / 'tickets.db'))
+    monkeypatch.setattr(Config, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    return create_app()
+
+
+@pytest.mark.parametrize('start', range(LATEST_VERSION))
+def test_upgrade_from_older_version(app, start):
+    # Заявка добавляется в схему версии 0 или 1, чтобы ее учли и счетчики,
+    # появившиеся в миграциях до start
+    with app.app_context():
+        if start:
+            upgrade(1)
+        with db.engine.begin() as conn:
+            for statement in LEGACY_DDL if start == 0 else []:
+                conn.execute(db.text(statement))
+            conn.execute(db.text(
+                "INSERT INTO ticket (created_at, title, description, status, pc_name, ip_address, is_new) "
+                "VALUES ('2024-01-01 10:00:00', 't', 'd', 'Открыта', 'pc', '10.0.0.1', 1)"))
+        upgrade(start)
+        with db.engine.connect() as conn:
+            assert current_version(conn) == start
+
+        upgrade()
+
+        with db.engine.connect() as conn:
+            assert current_version(conn) == LATEST_VERSION
+            inspector = db.inspect(conn)
+            for table in db.metadata.sorted_tables:
+                columns = {column['name'] for column in inspector.get_columns(table.name)}
+                assert columns == {column.name for column in table.columns}, table.name
+                indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+                assert {index.name for index in table.indexes} <= indexes, table.name
+            assert conn.execute(db.text('SELECT status, count FROM status_count')).all() == [('Открыта', 1)]
+            assert conn.execute(db.text('SELECT ip_address, pc_name, status, count FROM requester_count')).all() == [
+                ('10.0.0.1', 'pc', 'Открыта', 1)]
@@ -0,0 +1,5 @@
+from app import create_app
+
+# Точка входа для боевого WSGI-сервера: gunicorn -c gunicorn.conf.py wsgi:app
+# Схему БД перед запуском обновляет `flask db upgrade`, а не воркеры
+app = create_app()